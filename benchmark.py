@@ -0,0 +1,320 @@
+from classes import *
+import functions
+import argparse
+import json
+import math
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def _network_setup(size, num_patterns, rule="hebbian"):
+    """Builds the patterns, network and probe shared by the benchmarks of a given configuration"""
+
+    patterns = functions.generate_patterns(num_patterns, size)
+    network = HopfieldNetwork(patterns, rule)
+    probe = functions.perturb_pattern(patterns[0], int(0.2 * size))
+    return patterns, network, probe
+
+
+# each benchmark builds its inputs for a (size, num_patterns) configuration and returns the call to time
+def _bench_hebbian_weights(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    return lambda: network.hebbian_weights(patterns)
+
+
+def _bench_storkey_weights(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    return lambda: network.storkey_weights(patterns)
+
+
+def _bench_update(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    return lambda: network.update(probe)
+
+
+def _bench_update_async(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    return lambda: network.update_async(probe)
+
+
+def _bench_dynamics(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    return lambda: network.dynamics(probe, DataSaver(), max_iter=100)
+
+
+def _bench_dynamics_async(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    return lambda: network.dynamics_async(probe, DataSaver(), max_iter=10 * size, skip=size)
+
+
+def _bench_compute_energy(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    saver = DataSaver()
+    return lambda: saver.compute_energy(probe, network.w)
+
+
+def _bench_pattern_match(size, num_patterns):
+    patterns = functions.generate_patterns(num_patterns, size)
+    return lambda: functions.pattern_match(patterns, patterns[-1])  # worst case: the last pattern matches
+
+
+def _bench_save_video(size, num_patterns):
+    patterns, network, probe = _network_setup(size, num_patterns)
+    saver = DataSaver()
+    network.dynamics(probe, saver, max_iter=100)
+    out_path = Path(tempfile.mkdtemp()) / ("benchmark.mp4" if shutil.which("ffmpeg") else "benchmark.gif")
+    return lambda: saver.save_video(out_path, (1, size))
+
+
+BENCHMARKS = {"hebbian_weights": _bench_hebbian_weights, "storkey_weights": _bench_storkey_weights,
+              "update": _bench_update, "update_async": _bench_update_async, "dynamics": _bench_dynamics,
+              "dynamics_async": _bench_dynamics_async, "compute_energy": _bench_compute_energy,
+              "pattern_match": _bench_pattern_match, "save_video": _bench_save_video}
+
+DEFAULT_SIZES = [10, 32, 100, 316, 1000, 3162, 10000]
+DEFAULT_LOADS = [0.25, 1.0]  # numbers of patterns, as fractions of the hebbian capacity N / (2 ln N)
+
+
+IMPORT_MODULES = ["functions", "classes", "experiment"]  # modules that must stay importable with NumPy only
+HEAVY_MODULES = ["matplotlib", "scipy", "pandas", "PIL"]  # dependencies only loaded on first use
+
+# measures the import of a module (sys.argv[1]) in a fresh interpreter, the memory being traced if sys.argv[2] is
+# "memory", and prints the time, the peak memory and the heavy modules (sys.argv[3:]) loaded by the import
+_IMPORT_SCRIPT = """
+import sys, time, tracemalloc
+if sys.argv[2] == "memory":
+    tracemalloc.start()
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(elapsed, tracemalloc.get_traced_memory()[1], ",".join(name for name in sys.argv[3:] if name in sys.modules))
+"""
+
+
+def benchmark_configurations(sizes=DEFAULT_SIZES, loads=DEFAULT_LOADS):
+    """Builds the (size, num_patterns) configurations of the benchmark suite
+
+    Parameters:
+    --------------
+    sizes: list of ints
+    -> sizes of the networks
+    loads: list of floats
+    -> numbers of patterns, as fractions of the hebbian capacity of each size
+
+    Output:
+    --------------
+    returns a sorted list of (size, num_patterns) tuples
+
+    CU: size >= 2 and load > 0
+    """
+
+    configurations = set()
+    for size in sizes:
+        capacity = size / (2 * math.log(size))
+        for load in loads:
+            configurations.add((int(size), max(1, int(load * capacity))))
+    return sorted(configurations)
+
+
+def run_benchmark(name, size, num_patterns, repeat=3):
+    """Measures the time and peak memory of one hot path for a given configuration
+
+    Parameters:
+    --------------
+    name: string
+    -> name of the benchmark (a key of BENCHMARKS)
+    size: int
+    -> size of the network
+    num_patterns: int
+    -> number of memorized patterns
+    repeat: int
+    -> number of timed runs, the fastest one being kept
+
+    Output:
+    --------------
+    returns a record (dictionary) with the keys "name", "size", "num_patterns", "time" (in seconds),
+    "peak_memory" (in bytes) and "error" (None, or the error raised by the hot path)
+
+    CU: repeat > 0
+    """
+
+    record = {"name": name, "size": size, "num_patterns": num_patterns, "time": None, "peak_memory": None,
+              "error": None}
+    try:
+        function = BENCHMARKS[name](size, num_patterns)
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()  # separate run, as tracing the allocations slows the hot path down
+        function()
+        record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        record["time"] = min(times)
+    except Exception as error:  # e.g. no video writer installed, or not enough memory for a configuration
+        record["error"] = f"{type(error).__name__}: {error}"
+    finally:
+        tracemalloc.stop()
+    return record
+
+
+def run_import_benchmark(module, repeat=3):
+    """Measures the time and peak memory of the import of a module, each run being done in a fresh interpreter
+
+    Parameters:
+    --------------
+    module: string
+    -> name of the module of the repository to import
+    repeat: int
+    -> number of timed imports, the fastest one being kept
+
+    Output:
+    --------------
+    returns a record (see run_benchmark) named "import_<module>", with a size and a number of patterns of 0 and an
+    additional key "heavy_modules" (list of the modules of HEAVY_MODULES loaded by the import)
+
+    CU: repeat > 0
+    """
+
+    record = {"name": f"import_{module}", "size": 0, "num_patterns": 0, "time": None, "peak_memory": None,
+              "error": None, "heavy_modules": None}
+    outputs = []
+    for mode in ["time"] * repeat + ["memory"]:  # separate run, as tracing the allocations slows the import down
+        process = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT, module, mode] + HEAVY_MODULES,
+                                 capture_output=True, text=True, cwd=Path(__file__).resolve().parent)
+        if process.returncode != 0:
+            record["error"] = process.stderr.strip().splitlines()[-1]
+            return record
+        outputs.append(process.stdout.split(" "))
+    record["time"] = min(float(output[0]) for output in outputs[:-1])
+    record["peak_memory"] = int(outputs[-1][1])
+    record["heavy_modules"] = [name for name in outputs[-1][2].strip().split(",") if name]
+    return record
+
+
+def run_benchmarks(names=None, configurations=None, repeat=3, verbose=False):
+    """Runs the benchmark suite
+
+    Parameters:
+    --------------
+    names: list of strings or None
+    -> names of the benchmarks to run (all of them if None)
+    configurations: list of tuples or None
+    -> (size, num_patterns) configurations (those of benchmark_configurations() if None)
+    repeat: int
+    -> number of timed runs per benchmark and configuration
+    verbose: bool
+    -> if True, prints each record as soon as it is measured
+
+    Output:
+    --------------
+    returns the list of records (see run_benchmark)
+    """
+
+    names = list(BENCHMARKS) if names is None else names
+    configurations = benchmark_configurations() if configurations is None else configurations
+    records = []
+    for name in names:
+        for size, num_patterns in configurations:
+            records.append(run_benchmark(name, size, num_patterns, repeat))
+            if verbose:
+                print(format_record(records[-1]))
+    return records
+
+
+def format_record(record):
+    """Returns a one-line description of a record"""
+
+    header = f"{record['name']:>16} N={record['size']:<6} P={record['num_patterns']:<5}"
+    if record["error"] is not None:
+        return f"{header} error: {record['error']}"
+    line = f"{header} time={record['time'] * 1e3:10.3f} ms  peak memory={record['peak_memory'] / 2 ** 20:9.3f} MiB"
+    if record.get("heavy_modules"):
+        line += f"  loads: {', '.join(record['heavy_modules'])}"
+    return line
+
+
+def save_baseline(records, path):
+    """Saves benchmark records as a JSON baseline"""
+
+    with open(path, "w") as file:
+        json.dump(records, file, indent=1)
+
+
+def load_baseline(path):
+    """Loads benchmark records saved as a JSON baseline"""
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def find_regressions(records, baseline, time_tolerance=1.5, memory_tolerance=1.2):
+    """Compares benchmark records with a baseline
+
+    Parameters:
+    --------------
+    records: list of dictionaries
+    -> new benchmark records
+    baseline: list of dictionaries
+    -> baseline benchmark records
+    time_tolerance: float
+    -> a record regresses if its time exceeds time_tolerance times the baseline time
+    memory_tolerance: float
+    -> a record regresses if its peak memory exceeds memory_tolerance times the baseline peak memory
+
+    Output:
+    --------------
+    returns a list of (record, baseline record, reason) tuples, one per regression
+
+    CU: time_tolerance >= 1 and memory_tolerance >= 1
+    """
+
+    reference = {(record["name"], record["size"], record["num_patterns"]): record for record in baseline}
+    regressions = []
+    for record in records:
+        previous = reference.get((record["name"], record["size"], record["num_patterns"]))
+        if previous is None or previous["error"] is not None:
+            continue
+        if record["error"] is not None:
+            regressions.append((record, previous, "error"))
+        elif record["time"] > time_tolerance * previous["time"]:
+            regressions.append((record, previous, "time"))
+        elif record["peak_memory"] > memory_tolerance * max(previous["peak_memory"], 1):
+            regressions.append((record, previous, "memory"))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of the Hopfield network.")
+    parser.add_argument("--names", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="network sizes")
+    parser.add_argument("--loads", nargs="+", type=float, default=DEFAULT_LOADS,
+                        help="numbers of patterns as fractions of the hebbian capacity")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--imports", action="store_true",
+                        help="also measure the import of the core modules, each in a fresh interpreter")
+    parser.add_argument("--save", help="path of a JSON file in which the records are saved as the new baseline")
+    parser.add_argument("--compare", help="path of a JSON baseline to compare the records with")
+    parser.add_argument("--time-tolerance", type=float, default=1.5)
+    parser.add_argument("--memory-tolerance", type=float, default=1.2)
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.names, benchmark_configurations(arguments.sizes, arguments.loads),
+                             arguments.repeat, verbose=True)
+    if arguments.imports:
+        for module in IMPORT_MODULES:
+            results.append(run_import_benchmark(module, arguments.repeat))
+            print(format_record(results[-1]))
+    if arguments.save:
+        save_baseline(results, arguments.save)
+    if arguments.compare:
+        regressions = find_regressions(results, load_baseline(arguments.compare), arguments.time_tolerance,
+                                       arguments.memory_tolerance)
+        for new, old, reason in regressions:
+            print(f"REGRESSION ({reason}): {format_record(new)}  (baseline: {format_record(old)})")
+        if regressions:
+            raise SystemExit(1)
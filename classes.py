@@ -1,32 +1,118 @@
 import numpy as np
 import random as rd
-import matplotlib.pyplot as plt
-import matplotlib.animation as anim
+import json
+import csv
+import time
+import shutil
+import subprocess
+from pathlib import Path
+import kernels
+from functions import storkey_weights_blocked, diluted_connections, hebbian_weights_diluted, \
+    storkey_weights_diluted, state_key, hebbian_weights_out_of_core, storkey_weights_out_of_core
+
+
+def _check_counts(num_patterns, dtype):
+    """Raises a ValueError if the hebbian counts of num_patterns patterns do not fit in an integer dtype"""
+
+    if num_patterns > np.iinfo(dtype).max:
+        raise ValueError(f"The hebbian counts of {num_patterns} patterns do not fit in {np.dtype(dtype).name}.")
+
+
+def _dot(weights, x):
+    """Returns weights.dot(x) (dense, CSR or low-rank weights), accumulated in int64 with integer weights
+
+    The products and sums are never computed in the dtype of narrow integer weights (int8, int16), whose local
+    fields (up to N.P) would overflow, and the weights are not copied to a wider dtype.
+    """
+
+    if not np.issubdtype(weights.dtype, np.integer):
+        return weights.dot(x)
+    if isinstance(weights, np.ndarray):
+        return np.einsum("j,j->" if weights.ndim == 1 else "ij,j...->i...", weights, x, dtype=np.int64)
+    return weights.dot(np.asarray(x, dtype=np.int64))  # CSR weights matrix: O(N) copy of the state only
 
 
 class HopfieldNetwork:
 
-    def __init__(self, patterns, rule="hebbian"):
-        """Initialize the attributes "patterns" and "rule"
+    def __init__(self, patterns, rule="hebbian", dtype=np.float64, connectivity=None, degree=None, rng=None,
+                 low_rank=False, tracer=None):
+        """Initialize the attributes "patterns", "rule", "dtype", "connectivity" and "low_rank"
+
+        Parameters:
+        --------------
+        patterns : array
+        -> patterns to memorize (one pattern per row)
+        rule : string
+        -> learning rule used to create the weights matrix ("hebbian" or "storkey")
+        dtype : numpy dtype
+        -> dtype of the weights matrix: np.float64, np.float32, or an integer dtype (hebbian rule only) to store the
+        exact hebbian counts, the 1/P scale being kept apart in the attribute "weight_scale"
+        connectivity : string or None
+        -> None for a fully connected network (dense weights matrix), "random" or "fixed" for a diluted network whose
+        weights matrix is stored in CSR form (see functions.diluted_connections)
+        degree : int or None
+        -> number of connections per neuron of a diluted network
+        rng : numpy Generator
+        -> random generator used to draw the connections of a diluted network
+        low_rank : bool
+        -> if True (hebbian rule only), the weights matrix is never built: it is kept in the factored form P^T.P / M
+        (see LowRankWeights), the memory and the cost of a step being O(P.N) instead of O(N^2)
+        tracer : Tracer or None
+        -> if given, the construction of the weights and the calls of dynamics and dynamics_async are recorded in it
 
         Output:
         --------------
         Initialization of all the attributes with or depending on parameters
+
+        CU: rule = "hebbian" or rule = "storkey", dtype is a floating dtype if rule = "storkey", and 0 < degree < N
+        if connectivity is not None, and rule = "hebbian", dtype is a floating dtype and connectivity is None if
+        low_rank is True
         """
         self.patterns = patterns
         self.rule = rule
-        if rule == "hebbian":
-            self.w = self.hebbian_weights(patterns)
+        self.dtype = np.dtype(dtype)
+        self.connectivity = connectivity
+        self.low_rank = low_rank
+        self.tracer = tracer
+        self.weight_scale = 1.0  # positive scale applied lazily to the weights matrix (energy only)
+        if rule != "hebbian" and np.issubdtype(self.dtype, np.integer):
+            raise ValueError("Integer weights are only available with the hebbian learning rule.")
+        if low_rank and (rule != "hebbian" or connectivity is not None or np.issubdtype(self.dtype, np.integer)):
+            raise ValueError("Low-rank weights are only available with the hebbian learning rule, floating weights "
+                             "and full connectivity.")
+        if np.issubdtype(self.dtype, np.integer):
+            _check_counts(patterns.shape[0], self.dtype)
+            self.weight_scale = 1 / max(patterns.shape[0], 1)
+        record = None if tracer is None else tracer.start("build_weights", rule=rule, size=patterns.shape[1],
+                                                          num_patterns=patterns.shape[0])
+        if connectivity is not None:
+            import scipy.sparse  # only needed by diluted networks
+            indptr, indices = diluted_connections(patterns.shape[1], degree, connectivity, rng)
+            if rule == "hebbian":
+                data = hebbian_weights_diluted(patterns, indptr, indices, self.dtype)
+            else:
+                data = storkey_weights_diluted(patterns, indptr, indices).astype(self.dtype, copy=False)
+            self.w = scipy.sparse.csr_matrix((data, indices, indptr), shape=(patterns.shape[1], patterns.shape[1]))
+            self._index_columns()
+        elif low_rank:
+            self.w = LowRankWeights(patterns, self.dtype)
+        elif rule == "hebbian":
+            self.w = self.hebbian_weights(patterns, self.dtype)
         else:
-            self.w = self.storkey_weights(patterns)
+            self.w = self.storkey_weights(patterns).astype(self.dtype, copy=False)
+        if record is not None:
+            tracer.stop(record)
 
-    def hebbian_weights(self, patterns):
+    def hebbian_weights(self, patterns, dtype=np.float64):
         """Creates the weight matrix by using the hebbian learning rule on given patterns
 
         Parameters:
         --------------
         patterns: array
         -> patterns randomly generated previously to which the hebbian learning rule will be applied
+        dtype : numpy dtype
+        -> dtype of the weight matrix; with an integer dtype, the exact counts sum(p_i.p_j) are returned
+        without the 1/P scale
 
         Output:
         --------------
@@ -46,10 +132,11 @@ class HopfieldNetwork:
                 [-0.33333333, -1.        ,  0.        , -0.33333333],
                 [-0.33333333,  0.33333333, -0.33333333,  0.        ]])
         """
-        w = np.zeros([patterns.shape[1], patterns.shape[1]])  # initialisation of the weights matrix
-        for row in range(patterns.shape[0]):
-            w += np.outer(patterns[row], patterns[row]) * 1 / patterns.shape[
-                0]  # computation of the average contribution of each pattern to the synaptic weight
+        dtype = np.dtype(dtype)
+        patterns = patterns.astype(np.int32 if np.issubdtype(dtype, np.integer) else dtype)  # no int8 overflow
+        w = np.dot(patterns.T, patterns).astype(dtype, copy=False)  # sum of the contributions of each pattern
+        if not np.issubdtype(dtype, np.integer):
+            w /= patterns.shape[0]  # average contribution of each pattern to the synaptic weight
         np.fill_diagonal(w, 0)  # fill the diagonal of the matrix with zeros
         return w
 
@@ -65,6 +152,8 @@ class HopfieldNetwork:
         --------------
         returns the weights matrix (a multi-dimensional numpy array)
 
+        CU : the elements of the patterns are either -1 or 1
+
         Examples:
         --------------
         >>> storkey_weights(np.array([[1, 1, -1, -1], [1, 1, -1, 1], [-1, 1, -1, 1]]))
@@ -73,23 +162,145 @@ class HopfieldNetwork:
                 [-0.25 , -1.   ,  0.625, -0.25 ],
                 [-0.5  ,  0.25 , -0.25 ,  1.125]])
         """
-        w = np.zeros([patterns.shape[1], patterns.shape[1]])
-        for mu in range(patterns.shape[0]):
-            w_calculation_h = w.copy()
-            np.fill_diagonal(w_calculation_h, 0)
-            pattern_calculation_h = np.dot(patterns[mu].copy().reshape(patterns.shape[1], 1), np.ones(
-                (1, patterns.shape[1])))
-            np.fill_diagonal(pattern_calculation_h, 0)
-            h = np.dot(w_calculation_h,
-                       pattern_calculation_h)
-            w += np.outer(patterns[mu].copy(), patterns[mu].copy()) / patterns.shape[
-                1]
-            product_1 = patterns[
-                            mu].copy() * h.copy()
-            product_2 = product_1.T
-            w -= np.add(product_2, product_1) / patterns.shape[
-                1]
-        return w
+        return storkey_weights_blocked(patterns)  # O(N^2) per pattern, the patterns being folded in by blocks
+
+    def add_patterns(self, patterns):
+        """Memorizes new patterns by updating the weights matrix in place instead of rebuilding it
+
+        Parameters:
+        --------------
+        patterns : array
+        -> new patterns to memorize (one pattern per row)
+
+        Output:
+        --------------
+        updates the weights matrix with a rank-k update (k being the number of new patterns) and appends the new
+        patterns to the memorized ones
+        """
+
+        patterns = np.atleast_2d(patterns)
+        if np.issubdtype(self.dtype, np.integer):
+            _check_counts(self.patterns.shape[0] + patterns.shape[0], self.dtype)
+        if self.low_rank:
+            self.w = LowRankWeights(np.vstack([self.patterns, patterns]), self.dtype)  # O(P.N), nothing to update
+        elif self.connectivity is not None:
+            num_old, num_new = self.patterns.shape[0], patterns.shape[0]
+            if self.rule == "storkey":
+                self.w.data = storkey_weights_diluted(patterns, self.w.indptr, self.w.indices,
+                                                      self.w.data.astype(np.float64)).astype(self.dtype, copy=False)
+            elif np.issubdtype(self.dtype, np.integer):
+                self.w.data += hebbian_weights_diluted(patterns, self.w.indptr, self.w.indices, self.dtype)
+                self.weight_scale = 1 / (num_old + num_new)
+            else:
+                self.w.data *= num_old / (num_old + num_new)
+                self.w.data += hebbian_weights_diluted(patterns, self.w.indptr, self.w.indices) * (
+                    num_new / (num_old + num_new))
+            self._index_columns()
+        elif self.rule == "hebbian":
+            num_old, num_new = self.patterns.shape[0], patterns.shape[0]
+            contributions = patterns.astype(self.w.dtype)
+            if np.issubdtype(self.w.dtype, np.integer):
+                self.w += np.dot(contributions.T, contributions)  # exact counts, the scale is updated lazily
+                self.weight_scale = 1 / (num_old + num_new)
+            else:
+                self.w *= num_old / (num_old + num_new)  # rescaling the average over the old patterns
+                self.w += np.dot(contributions.T, contributions) / (num_old + num_new)  # rank-k update
+            np.fill_diagonal(self.w, 0)
+        else:
+            storkey_weights_blocked(patterns, weights=self.w)  # the storkey rule is incremental by construction
+        self.patterns = np.concatenate((self.patterns, patterns))
+
+    def remove_patterns(self, indices):
+        """Forgets memorized patterns by updating the weights matrix in place (hebbian rule only)
+
+        Parameters:
+        --------------
+        indices : int or list of ints
+        -> indices of the rows of the memorized patterns to forget
+
+        Output:
+        --------------
+        updates the weights matrix with a rank-k downdate (k being the number of forgotten patterns) and removes the
+        forgotten patterns from the memorized ones
+
+        CU: rule = "hebbian"
+        """
+
+        if self.rule != "hebbian":
+            raise ValueError("Patterns can only be removed from a network using the hebbian learning rule.")
+        indices = np.unique(indices)
+        contributions = self.patterns[indices].astype(self.w.dtype)
+        num_old, num_new = self.patterns.shape[0], self.patterns.shape[0] - len(indices)
+        if self.low_rank:
+            self.patterns = np.delete(self.patterns, indices, axis=0)
+            self.w = LowRankWeights(self.patterns, self.dtype)
+            return
+        if self.connectivity is not None:
+            counts = hebbian_weights_diluted(self.patterns[indices], self.w.indptr, self.w.indices, np.int64)
+            if np.issubdtype(self.w.dtype, np.integer):
+                self.w.data -= counts.astype(self.w.dtype)
+                self.weight_scale = 1 / max(num_new, 1)
+            else:
+                self.w.data *= num_old
+                self.w.data -= counts
+                self.w.data /= max(num_new, 1)
+            self._index_columns()
+            self.patterns = np.delete(self.patterns, indices, axis=0)
+            return
+        if np.issubdtype(self.w.dtype, np.integer):
+            self.w -= np.dot(contributions.T, contributions)  # exact counts, the scale is updated lazily
+            self.weight_scale = 1 / max(num_new, 1)
+        else:
+            self.w *= num_old
+            self.w -= np.dot(contributions.T, contributions)  # rank-k downdate with the forgotten patterns
+            self.w /= max(num_new, 1)
+        np.fill_diagonal(self.w, 0)
+        self.patterns = np.delete(self.patterns, indices, axis=0)
+
+    def _index_columns(self):
+        """Stores the columns of a diluted weights matrix in CSR form, for the O(K) updates of the local fields"""
+
+        self.w_columns = self.w if self.connectivity == "random" else self.w.T.tocsr()  # random: symmetric matrix
+
+    def _field(self, index, state):
+        """Returns the local field of one neuron (O(N) for a dense network, O(K) diluted, O(P.N) low-rank)"""
+
+        if self.low_rank:
+            return self.w.field(self.w.overlaps(state), index, state)
+        if self.connectivity is None:
+            return _dot(self.w[index], state)
+        start, end = self.w.indptr[index], self.w.indptr[index + 1]
+        return _dot(self.w.data[start:end], state[self.w.indices[start:end]])
+
+    def _cached_fields(self, state):
+        """Returns the cache of the asynchronous dynamics: the local fields, or the overlaps P.s if low-rank"""
+
+        return self.w.overlaps(state) if self.low_rank else _dot(self.w, state)
+
+    def _cached_field(self, cache, index, state):
+        """Returns the local field of one neuron from the cache of the asynchronous dynamics"""
+
+        return self.w.field(cache, index, state) if self.low_rank else cache[index]
+
+    def _energy_fields(self, fields, indices, state):
+        """Returns the local fields of the symmetric part (W + W^T) / 2 of the weights matrix at the given neurons, from
+        their local fields W.s (the energy only depends on this part, which differs from W with fixed connectivity)"""
+
+        if self.connectivity != "fixed":
+            return fields  # symmetric weights matrix
+        return (fields + _dot(self.w_columns[indices], state)) / 2  # O(K) per neuron, from the columns of W
+
+    def _add_column(self, fields, index, delta):
+        """Updates the cache of the asynchronous dynamics after a flip (O(N) dense, O(K) diluted, O(P) low-rank)"""
+
+        if self.low_rank:
+            fields += self.w.patterns[:, index] * delta  # the overlaps P.s
+        elif self.connectivity is None:
+            fields += self.w[index] * fields.dtype.type(delta)  # contiguous row, equal to the column (symmetric
+            # weights matrix), accumulated in the dtype of the fields
+        else:
+            start, end = self.w_columns.indptr[index], self.w_columns.indptr[index + 1]
+            fields[self.w_columns.indices[start:end]] += self.w_columns.data[start:end] * fields.dtype.type(delta)
 
     def update(self, state):
         """Applies the update rule to a state pattern
@@ -110,7 +321,7 @@ class HopfieldNetwork:
         >>> update(np.array([1, 1, -1, 1]), np.array([[1, 1, 1, -1], [1, 1, 1, -1]]))
         [array([1, 1])]
         """
-        return np.where(np.dot(self.w, state) >= 0, 1, -1)
+        return np.where(_dot(self.w, state) >= 0, 1, -1).astype(state.dtype, copy=False)
 
     def update_async(self, state):
         """Applies the asynchronous update rule to a state pattern
@@ -131,101 +342,446 @@ class HopfieldNetwork:
         >>> update_async(np.array([-1, -1, -1, 1]), np.array([[1, 1, -1, -1], [1, 1, 1, 1]]))
         array([-1, -1, -1,  1])
         """
-        index = rd.choices(np.linspace(0, self.w.shape[0] - 1, self.w.shape[0], dtype=int))  # chooses randomly an index
+        index = rd.randrange(self.w.shape[0])  # chooses randomly an index
         pattern = state.copy()
-        pattern[index] = np.where(np.dot(self.w[index], state) >= 0, 1, -1)  # applying the asynchronous update rule
+        pattern[index] = 1 if self._field(index, state) >= 0 else -1  # applying the asynchronous update rule
         # (updates the i-th component of the state pattern)
         return pattern
 
-    def dynamics(self, state, saver, max_iter=20):
-        """Runs the dynamical system from an initial state until convergence
+    def dynamics(self, state, saver, max_iter=20, cycle_memory=8):
+        """Runs the dynamical system from an initial state until convergence, until it enters a limit cycle,
         or until a maximum number of steps is reached
 
         Parameters:
         --------------
         state : array
         -> initial network state
-        weights : array
-        -> weights matrix
+        saver : DataSaver
+        -> saver in which the state history is stored
         max_iter : int
         -> maximum number of steps that can be reached
+        cycle_memory : int
+        -> number of recent states (kept as bit-packed keys) against which each new state is compared
 
         Output:
         --------------
-        returns the list of the state history
+        stores the state history in the saver (up to the first repeated state) and returns the length of the cycle
+        (1 for a fixed point, 2 for the usual oscillations of the synchronous dynamics) and the step at which it was
+        entered, or (None, None) if no state was repeated within max_iter steps
 
-        CU : max_iter >= 0
+        CU : max_iter >= 0 and cycle_memory > 0
 
         Examples:
         --------------
         >>> dynamics(np.array([1, 8, 0, 9]), np.array([[1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 1, 1]]), 10)
         [array([1, 8, 0, 9]), array([1, 1, 1, 1]), array([1, 1, 1, 1])]
         """
-        saver.store_iter(state, self.w)
+        record = None if self.tracer is None else self.tracer.start("dynamics", size=state.shape[0])
+        if record is not None:
+            saver = _TracedSaver(saver, record)
+        saver.store_iter(state, self.w, self.weight_scale)
         previous_state = state.copy()
+        recent_steps = {}  # keys of the recent states -> steps at which they were reached
+        if np.all(np.abs(state) == 1):
+            recent_steps[state_key(state)] = 0
+        cycle = (None, None)
         for i in range(max_iter):
-            new_state = self.update(previous_state)  # updating the state
-            saver.store_iter(new_state, self.w)  # adding the updated state to the state history list
-            if np.allclose(previous_state,
-                           new_state):  # verifies if the state before the update is equal to the updated state
-                break  # goes out of the for-loop because convergence is reached
-            previous_state = new_state.copy()  # iterative perspective of the dynamical evolution of the pattern
-
-    def dynamics_async(self, state, saver, max_iter=1000, convergence_num_iter=100, skip=10):
+            fields = _dot(self.w, previous_state)  # local fields, kept to track the energy
+            new_state = np.where(fields >= 0, 1, -1).astype(previous_state.dtype, copy=False)  # updating the state
+            if saver.track_energy:
+                flipped = np.flatnonzero(new_state != previous_state)
+                saver.track_flips(flipped, new_state[flipped] - previous_state[flipped],
+                                  self._energy_fields(fields[flipped], flipped, previous_state), self.w,
+                                  self.weight_scale)
+            saver.store_iter(new_state, self.w, self.weight_scale, tracked=True)  # adding the updated state to the
+            # state history list
+            if record is not None:
+                record["iterations"] += 1
+                record["flips"] += int(np.count_nonzero(new_state != previous_state))
+                start = time.perf_counter()
+            key = state_key(new_state)
+            repeated = key in recent_steps
+            if record is not None:
+                record["check_time"] += time.perf_counter() - start
+            if repeated:  # the state was already reached: convergence (cycle of length 1) or limit cycle
+                cycle = (i + 1 - recent_steps[key], recent_steps[key])
+                break
+            recent_steps[key] = i + 1
+            if len(recent_steps) > cycle_memory:
+                del recent_steps[next(iter(recent_steps))]  # forgetting the oldest state (insertion order)
+            previous_state = new_state  # iterative perspective of the dynamical evolution of the pattern
+        if record is not None:
+            self.tracer.stop(record)
+        return cycle
+
+    def dynamics_async(self, state, saver, max_iter=1000, convergence_num_iter=100, skip=10, order="random"):
         """Runs the dynamical system from an initial state until a maximum number
         of steps is reached or a convergence for a given number of steps is reached
 
+        The local fields h = W.s are computed once and kept up to date: a step only reads the field of the chosen
+        neuron, and the fields are updated in O(N) only when the neuron actually flips.
+
         Parameters:
         --------------
         state : array
         -> initial network state
-        weights : array
-        -> weights matrix
+        saver : DataSaver
+        -> saver in which the state history is stored
         max_iter : int
         -> maximum number of steps that can be reached
         convergence_num_iter : int
-        -> maximum number of iterations in which the algorithm can reach convergence
+        -> maximum number of iterations in which the algorithm can reach convergence (order = "random" only)
         skip : int
         -> used to save only one every skip states during the evolution of the patterns
+        order : string
+        -> "random" to update a randomly chosen neuron at each step, "permutation" to update the neurons by sweeps
+        over random permutations, stopping as soon as a full sweep produces no flip
 
         Output:
         --------------
-        returns the list of the state history
+        stores the state history in the saver (the final state being always stored) and returns whether the final
+        state is a fixed point of the dynamics
 
-        CU: max_iter >= 0 and convergence_num_iter >= 0
+        CU: max_iter >= 0, convergence_num_iter >= 0, skip > 0 and order = "random" or order = "permutation"
 
         Examples:
         --------------
         >>> dynamics_async(np.array([-1, -1, -1, 1]), np.array([[1, 1, -1, -1], [1, 1, 1, 1]]), 10, 6)
         [array([-1, -1, -1,  1]), array([-1, -1, -1,  1])]
         """
-        saver.store_iter(state, self.w)
-        previous_state = state.copy()
-        nb_iter = nb_iter_convergence = 0
-        while (nb_iter < max_iter) and (nb_iter_convergence < convergence_num_iter):  # two conditions to run
-            # the dynamical system : a maximum number of iterations and a minimum number of convergence iterations
-            new_state = self.update_async(previous_state)  # updating the state
-            if nb_iter % skip == 0:
-                saver.store_iter(new_state, self.w)
-            if np.allclose(previous_state, new_state):  # verifies if the state before the update is equal
-                # to the updated state
-                nb_iter_convergence += 1
-            previous_state = new_state.copy()  # affecting the updated pattern to the previous one
-            # to perform the next updating step
-            nb_iter += 1
+        record = None if self.tracer is None else self.tracer.start("dynamics_async", size=state.shape[0])
+        if record is not None:
+            saver = _TracedSaver(saver, record)
+        saver.store_iter(state, self.w, self.weight_scale)
+        state = state.copy()  # the neurons are then flipped in place
+        size = state.shape[0]
+        fields = self._cached_fields(state)  # cached local fields (exact with integer weights), or overlaps
+        if self._kernel_inputs(state, saver) is not None:  # same steps, run by the compiled kernel
+            nb_iter, nb_flips, stored = self._dynamics_async_kernel(state, fields, saver, max_iter,
+                                                                    convergence_num_iter, skip, order)
+        else:
+            nb_iter = nb_iter_convergence = sweep_flips = nb_flips = 0
+            stored = True
+            while (nb_iter < max_iter) and (nb_iter_convergence < convergence_num_iter or order == "permutation"):
+                if order == "permutation":
+                    if nb_iter % size == 0:
+                        if nb_iter > 0 and sweep_flips == 0:
+                            break  # a full sweep without any flip: the state is a fixed point
+                        permutation = np.random.permutation(size)
+                        sweep_flips = 0
+                    index = permutation[nb_iter % size]
+                else:
+                    index = rd.randrange(size)  # chooses randomly an index
+                field = self._cached_field(fields, index, state)
+                new_value = 1 if field >= 0 else -1  # applying the asynchronous update rule
+                if new_value != state[index]:
+                    if saver.track_energy:
+                        saver.track_flips(index, new_value - state[index], self._energy_fields(field, index, state),
+                                          self.w, self.weight_scale)
+                    self._add_column(fields, index, new_value - state[index])  # O(N), O(K) if diluted, O(P) if low-rank
+                    state[index] = new_value
+                    sweep_flips += 1
+                    nb_flips += 1
+                else:
+                    nb_iter_convergence += 1
+                stored = nb_iter % skip == 0
+                if stored:
+                    saver.store_iter(state, self.w, self.weight_scale, tracked=True)
+                nb_iter += 1
+        if not stored:
+            saver.store_iter(state, self.w, self.weight_scale, tracked=True)
+        if record is not None:
+            start = time.perf_counter()
+        fixed_point = bool(np.all(np.where(_dot(self.w, state) >= 0, 1, -1) == state))
+        if record is not None:
+            record["check_time"] += time.perf_counter() - start
+            record["iterations"], record["flips"] = nb_iter, nb_flips
+            self.tracer.stop(record)
+        return fixed_point
+
+    def _kernel_inputs(self, state, saver):
+        """Returns the inputs of the compiled kernel of the asynchronous dynamics (see kernels.py), or None if it is not
+        built, if the energy is tracked, or if the state and the weights matrix are not an int8 state and a dense
+        C-contiguous float64 matrix"""
+
+        if not kernels.COMPILED or saver.track_energy or self.low_rank or self.connectivity is not None \
+                or state.dtype != np.int8:
+            return None
+        return kernels.kernel_inputs(state, self.w)
+
+    def _dynamics_async_kernel(self, state, fields, saver, max_iter, convergence_num_iter, skip, order):
+        """Runs the loop of dynamics_async with the compiled kernel, one call of the kernel per stored state
+
+        The neurons are drawn exactly as in the Python loop, which gives the same states; the weights matrix being
+        symmetric, each flip reads one of its rows. The random order is cut where the convergence may be reached, so
+        that no neuron is drawn after the last step.
+
+        Output:
+        --------------
+        returns the number of steps, the number of flips and whether the final state has been stored
+        """
+
+        size = state.shape[0]
+        nb_iter = nb_iter_convergence = nb_flips = sweep_flips = 0
+        stored = True
+        while (nb_iter < max_iter) and (nb_iter_convergence < convergence_num_iter or order == "permutation"):
+            end = min(-(-nb_iter // skip) * skip + 1, max_iter)  # up to the next stored state
+            if order == "permutation":
+                if nb_iter % size == 0:
+                    if nb_iter > 0 and sweep_flips == 0:
+                        break  # a full sweep without any flip: the state is a fixed point
+                    permutation = np.random.permutation(size)
+                    sweep_flips = 0
+                end = min(end, nb_iter - nb_iter % size + size)  # up to the end of the sweep
+                indices = permutation[nb_iter % size:nb_iter % size + end - nb_iter]
+            else:
+                end = min(end, nb_iter + convergence_num_iter - nb_iter_convergence)
+                indices = np.array([rd.randrange(size) for _ in range(end - nb_iter)], dtype=np.intp)
+            flips = kernels.async_steps(self.w, state, fields, indices)
+            nb_iter_convergence += end - nb_iter - flips
+            sweep_flips += flips
+            nb_flips += flips
+            nb_iter = end
+            stored = (nb_iter - 1) % skip == 0
+            if stored:
+                saver.store_iter(state, self.w, self.weight_scale, tracked=True)
+        return nb_iter, nb_flips, stored
+
+    def recall_batch(self, states, max_iter=20):
+        """Runs the synchronous dynamical system on several initial states at once, with one matrix product per step
+
+        Parameters:
+        --------------
+        states : array
+        -> initial network states (one probe per row)
+        max_iter : int
+        -> maximum number of steps that can be reached
+
+        Output:
+        --------------
+        returns the final states (one per row), the number of iterations run for each probe and whether each probe
+        has converged (numpy arrays); a probe entering a 2-cycle is stopped as soon as the cycle is detected, without
+        being marked as converged
+
+        CU : max_iter >= 0
+        """
+
+        states = np.array(states, ndmin=2)  # copy of the probes, updated in place
+        iterations = np.zeros(states.shape[0], dtype=int)
+        converged = np.zeros(states.shape[0], dtype=bool)
+        active = np.arange(states.shape[0])  # rows which have not converged yet
+        older_states = None  # states of the active rows two steps before
+        for i in range(max_iter):
+            if active.size == 0:
+                break
+            previous_states = states[active]
+            new_states = np.where(_dot(self.w, previous_states.T).T >= 0, 1, -1).astype(states.dtype)
+            iterations[active] += 1
+            unchanged = np.all(new_states == previous_states, axis=1)  # per-row convergence mask
+            states[active] = new_states
+            converged[active[unchanged]] = True
+            stopped = unchanged
+            if older_states is not None:
+                stopped = unchanged | np.all(new_states == older_states, axis=1)  # 2-cycles
+            active, older_states = active[~stopped], previous_states[~stopped]  # stopped rows stop costing work
+        return states, iterations, converged
+
+    def save(self, path):
+        """Saves the network in a directory of uncompressed .npy files that can be memory-mapped by load
+
+        Parameters:
+        --------------
+        path : string or Path
+        -> directory in which the network is saved (created if needed): "meta.json" holds the rule, the dtype, the
+        connectivity and the weight scale, "patterns.npy" the patterns, and "weights.npy" the dense weights matrix
+        (or "data.npy", "indices.npy" and "indptr.npy" for a diluted network, and nothing for low-rank weights)
+
+        Output:
+        --------------
+        writes the files of the network
+        """
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "patterns.npy", self.patterns)
+        if self.connectivity is not None:
+            for name in ["data", "indices", "indptr"]:
+                np.save(path / f"{name}.npy", getattr(self.w, name))
+        elif not self.low_rank:
+            np.save(path / "weights.npy", self.w)
+        meta = {"rule": self.rule, "dtype": self.dtype.str, "connectivity": self.connectivity,
+                "low_rank": self.low_rank, "weight_scale": self.weight_scale}
+        with open(path / "meta.json", "w") as file:
+            json.dump(meta, file, indent=1)
+
+    @classmethod
+    def build_out_of_core(cls, patterns, path, rule="hebbian", dtype=np.float64, memory_budget=2 ** 28,
+                          block_size=64):
+        """Builds the weights matrix of a network directly into the memory-mapped files of save, by blocks of rows,
+        for networks whose weights matrix does not fit in memory
+
+        Parameters:
+        --------------
+        patterns : array
+        -> patterns to memorize (one pattern per row)
+        path : string or Path
+        -> directory in which the network is written (see save)
+        rule : string
+        -> learning rule, "hebbian" or "storkey"
+        dtype : numpy dtype
+        -> dtype of the weights matrix (an integer dtype stores the exact hebbian counts, see __init__)
+        memory_budget : int
+        -> approximate number of bytes that the temporary blocks can use
+        block_size : int
+        -> number of patterns folded in per pass over the matrix (storkey rule)
+
+        Output:
+        --------------
+        returns the network loaded with its weights matrix memory-mapped (see load)
+
+        CU: rule = "hebbian" or rule = "storkey", dtype is a floating dtype if rule = "storkey", memory_budget > 0
+        """
+
+        dtype = np.dtype(dtype)
+        if rule != "hebbian" and np.issubdtype(dtype, np.integer):
+            raise ValueError("Integer weights are only available with the hebbian learning rule.")
+        if np.issubdtype(dtype, np.integer):
+            _check_counts(patterns.shape[0], dtype)
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "patterns.npy", patterns)
+        size = patterns.shape[1]
+        weights = np.lib.format.open_memmap(path / "weights.npy", mode="w+", dtype=dtype, shape=(size, size))
+        if rule == "hebbian":
+            hebbian_weights_out_of_core(patterns, weights, memory_budget)
+        else:
+            storkey_weights_out_of_core(patterns, weights, memory_budget, block_size)
+        weights.flush()
+        del weights
+        weight_scale = 1 / max(patterns.shape[0], 1) if np.issubdtype(dtype, np.integer) else 1.0
+        meta = {"rule": rule, "dtype": dtype.str, "connectivity": None, "low_rank": False,
+                "weight_scale": weight_scale}
+        with open(path / "meta.json", "w") as file:
+            json.dump(meta, file, indent=1)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a network saved by save, without recomputing its weights
+
+        Parameters:
+        --------------
+        path : string or Path
+        -> directory in which the network was saved
+        mmap : bool
+        -> if True, the arrays are memory-mapped copy-on-write instead of being read: loading is near-instant, the
+        pages are only read when used, and the processes loading the same network share them through the page cache
+        (in-place updates such as add_patterns stay private to the process and are not written back)
+
+        Output:
+        --------------
+        returns the loaded HopfieldNetwork
+        """
+
+        path = Path(path)
+        with open(path / "meta.json") as file:
+            meta = json.load(file)
+        mmap_mode = "c" if mmap else None
+        network = cls.__new__(cls)  # the weights are loaded instead of being learnt
+        network.patterns = np.load(path / "patterns.npy", mmap_mode=mmap_mode)
+        network.rule = meta["rule"]
+        network.dtype = np.dtype(meta["dtype"])
+        network.connectivity = meta["connectivity"]
+        network.low_rank = meta["low_rank"]
+        network.tracer = None
+        network.weight_scale = meta["weight_scale"]
+        if network.connectivity is not None:
+            import scipy.sparse  # only needed by diluted networks
+            data, indices, indptr = [np.load(path / f"{name}.npy", mmap_mode=mmap_mode)
+                                     for name in ["data", "indices", "indptr"]]
+            size = network.patterns.shape[1]
+            network.w = scipy.sparse.csr_matrix((data, indices, indptr), shape=(size, size), copy=False)
+            network._index_columns()
+        elif network.low_rank:
+            network.w = LowRankWeights(network.patterns, network.dtype)
+        else:
+            network.w = np.load(path / "weights.npy", mmap_mode=mmap_mode)
+        return network
+
+
+class LowRankWeights:
+
+    def __init__(self, patterns, dtype=np.float64):
+        """Hebbian weights matrix W = P^T.P / M with a zeroed diagonal, kept in factored form
+
+        Parameters:
+        --------------
+        patterns : array
+        -> memorized patterns (one pattern per row), the only data stored
+        dtype : numpy dtype
+        -> floating dtype of the stored patterns and of the computations
+
+        Output:
+        --------------
+        Initialization of the attributes "patterns", "scale", "diagonal", "shape" and "dtype": the object can be used
+        instead of the weights matrix wherever only w.dot(x), w.shape and w[rows, columns] are needed
+
+        CU: dtype is a floating dtype
+        """
+        self.patterns = np.atleast_2d(patterns).astype(dtype)
+        self.scale = 1 / max(self.patterns.shape[0], 1)
+        self.diagonal = np.einsum("ij,ij->j", self.patterns, self.patterns) * self.scale  # removed from P^T.P / M
+        self.shape = (self.patterns.shape[1], self.patterns.shape[1])
+        self.dtype = self.patterns.dtype
+
+    def dot(self, x):
+        """Returns W.x = P^T.(P.x) / M - diag(P^T.P / M).x in O(P.N), x being a vector or a matrix of columns"""
+
+        x = np.asarray(x, dtype=self.dtype)
+        products = np.dot(self.patterns.T, np.dot(self.patterns, x)) * self.scale
+        return products - (self.diagonal * x.T).T
+
+    def overlaps(self, state):
+        """Returns the overlaps P.s between the memorized patterns and a state (cache of the asynchronous dynamics)"""
+
+        return np.dot(self.patterns, np.asarray(state, dtype=self.dtype))
+
+    def field(self, overlaps, index, state):
+        """Returns the local field of one neuron in O(P), given the overlaps P.s of the state"""
+
+        return np.dot(self.patterns[:, index], overlaps) * self.scale - self.diagonal[index] * state[index]
+
+    def __getitem__(self, key):
+        """Builds the block W[rows, columns] only, rows and columns being indexed independently (like np.ix_)"""
+
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        rows, columns = np.arange(self.shape[0])[rows], np.arange(self.shape[1])[columns]
+        block = np.dot(self.patterns[:, rows.ravel()].T, self.patterns[:, columns.ravel()]) * self.scale
+        block[rows.ravel()[:, np.newaxis] == columns.ravel()] = 0  # zeroed diagonal
+        return block.reshape([indices.size for indices in (rows, columns) if indices.ndim > 0])
 
 
 class DataSaver:
 
-    def __init__(self):
+    def __init__(self, track_energy=False, verify_every=None):
         """Initialize the attribute "data"
 
+        Parameters:
+        --------------
+        track_energy : bool
+        -> if True, the energy is updated from the flips passed by the dynamics (see track_flips) instead of being
+        recomputed in O(N^2) for every stored state
+        verify_every : int or None
+        -> if given, the tracked energy is checked against a full recompute every verify_every stored states
+
         Output:
         --------------
         Initialization of the attribute "data" to empty lists
         """
 
-        self.data = {"state": [], "energy": []}
+        self.track_energy = track_energy
+        self.verify_every = verify_every
+        self.reset()
 
     def reset(self):
         """Resets the attribute "data"
@@ -236,8 +792,82 @@ class DataSaver:
         """
 
         self.data = {"state": [], "energy": []}
+        self.energy = None  # tracked energy of the current state
+        self.num_tracked = 0  # number of stored states whose energy has been tracked
+
+    def track_flips(self, indices, deltas, fields, weights, scale=1.0):
+        """Updates the tracked energy after some neurons have changed, in O(k^2) for k changed neurons
+
+        With h = W.s the local fields before the change and d the changes of the neurons, the energy of a symmetric
+        network changes by -(d.h + d.W.d / 2), where only the k changed neurons are involved. For a non-symmetric
+        weights matrix, h must be the local fields of its symmetric part (W + W^T) / 2, d.W.d being unchanged.
+
+        Parameters:
+        --------------
+        indices : int or array of ints
+        -> indices of the changed neurons
+        deltas : int or array
+        -> changes of the values of these neurons (new value - old value)
+        fields : float or array
+        -> local fields of these neurons before the change (with the symmetric part of the weights matrix)
+        weights : array
+        -> weights matrix
+        scale : float
+        -> scale lazily applied to the weights matrix (1/P for integer hebbian counts)
 
-    def store_iter(self, state, weights):
+        Output:
+        --------------
+        Updates the tracked energy
+        """
+
+        if self.energy is None:
+            return
+        indices = np.atleast_1d(indices)
+        deltas = np.atleast_1d(deltas).astype(np.float64)
+        couplings = weights[np.ix_(indices, indices)].dot(deltas)  # dense or CSR weights matrix
+        self.energy -= scale * (np.dot(deltas, np.atleast_1d(fields)) + np.dot(deltas, couplings) / 2)
+
+    def energy_of(self, state, weights, scale=1.0, tracked=False):
+        """Returns the energy of a state, from the tracked energy when possible
+
+        Parameters:
+        --------------
+        state : array
+        -> network state
+        weights : array
+        -> weights matrix
+        scale : float
+        -> scale lazily applied to the weights matrix (1/P for integer hebbian counts)
+        tracked : bool
+        -> True if all the changes leading to this state have been passed to track_flips; otherwise the energy is
+        recomputed and tracking restarts from this state
+
+        Output:
+        --------------
+        returns the energy value associated to the network state
+        """
+
+        if self.track_energy and tracked and self.energy is not None:
+            self.num_tracked += 1
+            if self.verify_every and self.num_tracked % self.verify_every == 0:
+                energy = self.compute_energy(state, weights, scale)
+                if not np.isclose(self.energy, energy, rtol=1e-9, atol=self._energy_tolerance(state, weights, scale)):
+                    raise RuntimeError(f"The tracked energy {self.energy} differs from the computed energy {energy}.")
+            return self.energy
+        energy = self.compute_energy(state, weights, scale)
+        if self.track_energy:
+            self.energy = energy
+        return energy
+
+    def _energy_tolerance(self, state, weights, scale=1.0):
+        """Returns the absolute tolerance of the check of the tracked energy: eps.N^2.max|w| for the precision eps of
+        the weights (float64 for integer weights), each of the N local fields summing N rounded products"""
+
+        dtype = weights.dtype if np.issubdtype(weights.dtype, np.floating) else np.float64
+        max_weight = 1.0 if isinstance(weights, LowRankWeights) else float(abs(weights).max())  # |P^T.P / M| <= 1
+        return max(float(np.finfo(dtype).eps) * state.shape[0] ** 2 * max_weight * scale, 1e-9)
+
+    def store_iter(self, state, weights, scale=1.0, tracked=False):
         """Stores a given state and its associated energy in the attribute "data"
 
         Parameters:
@@ -246,6 +876,10 @@ class DataSaver:
         -> network state to which we will associate energy values
         weights : array
         -> weights matrix
+        scale : float
+        -> scale lazily applied to the weights matrix (1/P for integer hebbian counts)
+        tracked : bool
+        -> True if the changes leading to this state have been passed to track_flips (see energy_of)
 
         Output:
         --------------
@@ -253,9 +887,9 @@ class DataSaver:
         """
 
         self.data["state"].append(state.copy())
-        self.data["energy"].append(self.compute_energy(state, weights).copy())
+        self.data["energy"].append(self.energy_of(state, weights, scale, tracked))
 
-    def compute_energy(self, state, weights):
+    def compute_energy(self, state, weights, scale=1.0):
         """Returns the energy value associated to the network state
 
         Parameters:
@@ -264,6 +898,8 @@ class DataSaver:
         -> network state
         weights : array
         -> weights matrix
+        scale : float
+        -> scale lazily applied to the weights matrix (1/P for integer hebbian counts)
 
         Output:
         --------------
@@ -271,7 +907,8 @@ class DataSaver:
         """
 
         # computes the energy value associated to the state pattern
-        return -1 / 2 * np.dot(state, np.dot(weights, state.T))
+        fields = _dot(weights, state.T).astype(np.float64, copy=False)  # no overflow with integer weights
+        return -scale / 2 * np.dot(state, fields)
 
     def get_data(self):
         """Return the data attribute of the class DataSaver
@@ -281,35 +918,84 @@ class DataSaver:
         returns the data"""
         return self.data
 
-    def save_video(self, out_path, img_shape):
-        """Generates a video of the evolution of the system
+    def save_video(self, out_path, img_shape, stride=1, fps=15, scale=4, writer="auto"):
+        """Generates a video of the evolution of the system, streaming the frames to the encoder one by one
 
         Parameters:
         --------------
-        state_list : list of arrays
-        -> list of network state
-        out_path : string
+        out_path : string or Path
         -> path where the video will be saved
+        img_shape : tuple of ints
+        -> (height, width) of the image of a state
+        stride : int
+        -> only one every stride stored states is written (the final state being always written)
+        fps : int
+        -> frames per second of the video
+        scale : int
+        -> each neuron is drawn as a scale x scale block of pixels
+        writer : string
+        -> "ffmpeg" (raw grayscale frames piped to ffmpeg), "gif" (animated GIF), "png" (sequence of PNG images
+        out_path_00000.png, ...) or "auto": an animated GIF if out_path is a .gif, ffmpeg otherwise, and the sequence
+        of PNG images if ffmpeg is not installed
 
         Output:
         --------------
-        saves the video
+        saves the video and returns the path written: out_path, or the path of the first image with the PNG writer
+
+        CU: stride > 0, fps > 0, scale > 0, out_path is a .gif with the GIF writer, and ffmpeg is installed with the
+        ffmpeg writer
         """
 
-        frames = []  # initialising an empty list of frames
-        fig_video = plt.figure()  # definition of a figure (needed for the visualization)
-        writer = anim.writers['ffmpeg']  # initialization of pipe-based ffmpeg writer
-        writer_video = writer(fps=15, metadata=dict(artist='Me'),
-                              bitrate=1800)  # initialization of the writer parameter for saving the video
+        import matplotlib  # for the path of ffmpeg
 
-        state_history = self.get_data()["state"]
-        for element in state_history:
-            img = element.reshape(img_shape)
-            frames.append([plt.imshow(img, cmap='Greys')])  # creation of a list of images
+        out_path = Path(out_path)
+        if writer == "auto":
+            if out_path.suffix.lower() == ".gif":
+                writer = "gif"
+            else:  # the PNG images are named after out_path, which is never written with another format
+                writer = "ffmpeg" if shutil.which(matplotlib.rcParams["animation.ffmpeg_path"]) else "png"
+        if writer == "gif" and out_path.suffix.lower() != ".gif":
+            raise ValueError(f"The GIF writer writes .gif files, got {out_path}.")
+        if writer == "ffmpeg" and shutil.which(matplotlib.rcParams["animation.ffmpeg_path"]) is None:
+            raise RuntimeError(f"ffmpeg is needed to write {out_path}: install it, or use the GIF or PNG writer.")
+        frames = self._frames(img_shape, stride, scale)
+        if writer == "ffmpeg":
+            height, width = img_shape[0] * scale, img_shape[1] * scale
+            command = [matplotlib.rcParams["animation.ffmpeg_path"], "-y", "-loglevel", "error", "-f", "rawvideo",
+                       "-pix_fmt", "gray", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                       "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", str(out_path)]
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                for frame in frames:
+                    process.stdin.write(frame.tobytes())  # raw bytes, written as soon as the frame is built
+            finally:
+                process.stdin.close()
+                error = process.stderr.read()
+                process.wait()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg failed: {error.decode(errors='replace')}")
+            return out_path
+        from PIL import Image  # installed with matplotlib
+        if writer == "gif":
+            images = (Image.fromarray(frame) for frame in frames)  # uint8 arrays: grayscale images
+            first = next(images)
+            first.save(out_path, save_all=True, append_images=images, duration=1000 / fps, loop=0)
+            return out_path
+        paths = []
+        for i, frame in enumerate(frames):
+            paths.append(out_path.with_name(f"{out_path.stem}_{i:05d}.png"))
+            Image.fromarray(frame).save(paths[-1])
+        return paths[0]
 
-        video = anim.ArtistAnimation(fig_video, frames)  # definition of the animation
-        video.save(out_path, writer=writer_video)  # saving the video
-        plt.close(fig_video)  # closes the figure instance after saving the video
+    def _frames(self, img_shape, stride=1, scale=1):
+        """Yields the stored states as grayscale images (uint8 arrays, black for the neurons in state 1)"""
+
+        state_history = self.get_data()["state"]
+        last = len(state_history) - 1
+        for i, state in enumerate(state_history):
+            if i % stride == 0 or i == last:
+                img = np.where(np.asarray(state).reshape(img_shape) > 0, 0, 255).astype(np.uint8)  # 'Greys' colormap
+                yield np.repeat(np.repeat(img, scale, axis=0), scale, axis=1)
 
     def plot_energy(self):
         """Generates a plot of the evolution of the energy function
@@ -319,6 +1005,8 @@ class DataSaver:
         Plot of the energy function versus time
         """
 
+        import matplotlib.pyplot as plt  # imported on first use only
+
         plt.figure(figsize=(5, 7))
         plt.plot(np.arange(0, len(self.get_data()["state"]), step=1), self.get_data()["energy"], color='red')  # creates a plot of the energy versus time
         plt.xlabel("Time [s]")
@@ -326,3 +1014,507 @@ class DataSaver:
         plt.title("Plot of the energy versus the time")
         plt.show()  # show the plot of the energy versus time
         plt.close()  # closes the figure instance after plotting the energy function
+
+
+class MemmapDataSaver(DataSaver):
+
+    def __init__(self, path, capacity=1024, buffer_size=256, track_energy=False, verify_every=None):
+        """Initialize the attributes of a saver writing the trajectory to a memory-mapped file
+
+        Each stored step is a record made of the state packed to bits and of its energy. The last steps are kept
+        in a bounded in-memory ring buffer and written to the file by chunks, the file growing when it is full.
+
+        Parameters:
+        --------------
+        path : string or Path
+        -> path of the file in which the trajectory is written
+        capacity : int
+        -> number of records preallocated in the file (doubled each time the file is full)
+        buffer_size : int
+        -> number of records kept in memory before being written to the file
+        track_energy : bool
+        -> if True, the energy is tracked from the flips passed by the dynamics (see DataSaver)
+        verify_every : int or None
+        -> if given, the tracked energy is checked against a full recompute every verify_every stored states
+
+        Output:
+        --------------
+        Initialization of all the attributes with or depending on parameters
+
+        CU: capacity > 0, buffer_size > 0 and the stored states are binary (-1 or 1)
+        """
+
+        self.path = Path(path)
+        self.initial_capacity = capacity
+        self.buffer_size = buffer_size
+        self.track_energy = track_energy
+        self.verify_every = verify_every
+        self.reset()
+
+    def reset(self):
+        """Resets the stored trajectory
+
+        Output:
+        --------------
+        Forgets all the stored records (the file is recreated at the next call of store_iter)
+        """
+
+        self.records = None  # memory-mapped records, created when the size of the states is known
+        self.capacity = self.initial_capacity
+        self.num_written = 0  # number of records written to the file
+        self.buffer_states = self.buffer_energies = None
+        self.buffer_len = 0  # number of records waiting in the ring buffer
+        self.energy = None  # tracked energy of the current state
+        self.num_tracked = 0
+
+    def _open(self, size):
+        """Creates the memory-mapped file and the ring buffer for states of a given size"""
+
+        self.record_dtype = np.dtype([("state", np.uint8, ((size + 7) // 8,)), ("energy", np.float64)])
+        self.size = size
+        self.records = np.memmap(self.path, dtype=self.record_dtype, mode="w+", shape=(self.capacity,))
+        self.buffer_states = np.empty((self.buffer_size, size), dtype=np.int8)
+        self.buffer_energies = np.empty(self.buffer_size)
+
+    def _grow(self, num_records):
+        """Grows the memory-mapped file so that it can hold at least num_records records"""
+
+        self.records.flush()
+        while self.capacity < num_records:
+            self.capacity *= 2
+        del self.records
+        with open(self.path, "r+b") as file:
+            file.truncate(self.capacity * self.record_dtype.itemsize)
+        self.records = np.memmap(self.path, dtype=self.record_dtype, mode="r+", shape=(self.capacity,))
+
+    def flush(self):
+        """Writes the records of the ring buffer to the memory-mapped file
+
+        Output:
+        --------------
+        Empties the ring buffer into the file
+        """
+
+        if self.buffer_len == 0:
+            return
+        end = self.num_written + self.buffer_len
+        if end > self.capacity:
+            self._grow(end)
+        self.records["state"][self.num_written:end] = np.packbits(self.buffer_states[:self.buffer_len] > 0, axis=1)
+        self.records["energy"][self.num_written:end] = self.buffer_energies[:self.buffer_len]
+        self.records.flush()
+        self.num_written = end
+        self.buffer_len = 0
+
+    def store_iter(self, state, weights, scale=1.0, tracked=False):
+        """Stores a given state and its associated energy in the ring buffer (written to the file when full)
+
+        Parameters:
+        --------------
+        state : array
+        -> network state to which we will associate energy values
+        weights : array
+        -> weights matrix
+        scale : float
+        -> scale lazily applied to the weights matrix (1/P for integer hebbian counts)
+        tracked : bool
+        -> True if the changes leading to this state have been passed to track_flips (see energy_of)
+
+        Output:
+        --------------
+        Stores a state and its energy value
+        """
+
+        if self.records is None:
+            self._open(state.shape[0])
+        self.buffer_states[self.buffer_len] = state
+        self.buffer_energies[self.buffer_len] = self.energy_of(state, weights, scale, tracked)
+        self.buffer_len += 1
+        if self.buffer_len == self.buffer_size:
+            self.flush()
+
+    def __len__(self):
+        """Returns the number of stored records"""
+
+        return self.num_written + self.buffer_len
+
+    def read_state(self, index):
+        """Returns a stored state, read from the ring buffer or unpacked from the file
+
+        Parameters:
+        --------------
+        index : int
+        -> index of the stored step (negative indices count from the end)
+
+        Output:
+        --------------
+        returns the state (a numpy array of -1 and 1)
+        """
+
+        index = range(len(self))[index]  # raises an IndexError when out of bounds
+        if index >= self.num_written:
+            return self.buffer_states[index - self.num_written].copy()
+        bits = np.unpackbits(self.records["state"][index], count=self.size)
+        return (2 * bits.astype(np.int8) - 1)
+
+    def read_energy(self, index):
+        """Returns a stored energy, read from the ring buffer or from the file
+
+        Parameters:
+        --------------
+        index : int
+        -> index of the stored step (negative indices count from the end)
+
+        Output:
+        --------------
+        returns the energy value (a float)
+        """
+
+        index = range(len(self))[index]  # raises an IndexError when out of bounds
+        if index >= self.num_written:
+            return self.buffer_energies[index - self.num_written]
+        return self.records["energy"][index]
+
+    def read_energies(self):
+        """Returns all the stored energies, the written ones being read from the file"""
+
+        if self.records is None:
+            return np.empty(0)
+        return np.concatenate((self.records["energy"][:self.num_written], self.buffer_energies[:self.buffer_len]))
+
+    def get_data(self):
+        """Returns lazy views on the stored states and energies
+
+        Output:
+        --------------
+        returns a dictionary with the keys "state" and "energy", whose values are read from the file on access"""
+        return {"state": Trajectory(self, "state"), "energy": Trajectory(self, "energy")}
+
+
+class Trajectory:
+
+    def __init__(self, saver, key):
+        """Initialize a lazy sequence over the states or the energies stored by a MemmapDataSaver
+
+        Parameters:
+        --------------
+        saver : MemmapDataSaver
+        -> saver in which the trajectory is stored
+        key : string
+        -> "state" or "energy"
+        """
+
+        self.saver = saver
+        self.key = key
+
+    def __len__(self):
+        """Returns the number of stored steps"""
+        return len(self.saver)
+
+    def __getitem__(self, index):
+        """Returns the state or energy of a step (or a list of them for a slice), read lazily"""
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        if self.key == "state":
+            return self.saver.read_state(index)
+        return self.saver.read_energy(index)
+
+    def __iter__(self):
+        """Yields the stored states or energies one at a time"""
+        for index in range(len(self)):
+            yield self[index]
+
+    def __array__(self, dtype=None, copy=None):
+        """Converts the whole trajectory to a numpy array (used when plotting the energies)"""
+        if self.key == "state":
+            return np.array([state for state in self], dtype=dtype)
+        return self.saver.read_energies().astype(dtype or np.float64)
+
+
+class PatternIndex:
+
+    def __init__(self, patterns):
+        """Initialize an index of the memorized patterns, built once per network
+
+        Exact matches are found with a hash table keyed by the bit-packed patterns, and approximate matches with a
+        single product between the patterns and the state(s).
+
+        Parameters:
+        --------------
+        patterns : array
+        -> memorized binary patterns (one pattern per row)
+
+        Output:
+        --------------
+        Initialization of all the attributes with or depending on parameters
+
+        CU: the elements of the patterns are either -1 or 1
+        """
+
+        self.patterns = patterns
+        self.size = patterns.shape[1]
+        self.matrix = patterns.astype(np.float32)  # exact for the overlaps of patterns of less than 2^24 neurons
+        self.keys = {}
+        for index, key in enumerate(np.packbits(patterns > 0, axis=1)):
+            self.keys.setdefault(key.tobytes(), index)  # the first matching row wins, as in pattern_match
+
+    def overlaps(self, states):
+        """Returns the overlaps between the memorized patterns and one state (or a matrix of states, one per row)"""
+
+        return np.dot(np.asarray(states, dtype=np.float32), self.matrix.T)
+
+    def match(self, state, max_distance=0):
+        """Returns the index of the memorized pattern matching a state
+
+        Parameters:
+        --------------
+        state : array
+        -> binary network state
+        max_distance : int
+        -> maximum number of neurons by which the state can differ from the pattern (0 for an exact match)
+
+        Output:
+        --------------
+        returns the index of the row of the matching pattern (the closest one if max_distance > 0), or None if no
+        memorized pattern matches
+
+        CU: max_distance >= 0
+        """
+
+        if max_distance == 0:
+            return self.keys.get(np.packbits(np.asarray(state) > 0).tobytes())
+        overlaps = self.overlaps(state)
+        index = int(np.argmax(overlaps))
+        if (self.size - overlaps[index]) / 2 <= max_distance:  # Hamming distance of the closest pattern
+            return index
+        return None
+
+    def match_batch(self, states, max_distance=0):
+        """Returns the indices of the memorized patterns matching a matrix of states, with a single product
+
+        Parameters:
+        --------------
+        states : array
+        -> binary network states (one state per row)
+        max_distance : int
+        -> maximum number of neurons by which a state can differ from its pattern (0 for exact matches)
+
+        Output:
+        --------------
+        returns an array with, for each state, the index of the row of the matching pattern (the closest one if
+        max_distance > 0), or -1 if no memorized pattern matches
+
+        CU: max_distance >= 0
+        """
+
+        overlaps = self.overlaps(np.atleast_2d(states))
+        indices = np.argmax(overlaps, axis=1)  # first closest pattern of each state
+        distances = (self.size - overlaps[np.arange(len(indices)), indices]) / 2
+        return np.where(distances <= max_distance, indices, -1)
+
+
+class ResultsStore:
+
+    columns = {"network_size": np.int64, "weight_rule": "S16", "num_patterns": np.int64, "num_perturb": np.int64,
+               "match_frac": np.float64, "num_trials": np.int64}
+
+    def __init__(self, path):
+        """Initialize an append-only store of the results of a sweep, one row per (size, rule, num_patterns) cell
+
+        Each column is a raw binary file of the directory path, a row being appended to all of them as soon as its
+        cell is finished: the results written before a crash or an interruption are kept, and a row left incomplete
+        by a crash is dropped when the store is opened again.
+
+        Parameters:
+        --------------
+        path : string or Path
+        -> directory of the store (created if needed, reopened if it exists)
+
+        Output:
+        --------------
+        Initialization of the attributes "path" and "num_rows"
+        """
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        lengths = []
+        for name, dtype in self.columns.items():
+            column_path = self.path / f"{name}.bin"
+            column_path.touch()
+            lengths.append(column_path.stat().st_size // np.dtype(dtype).itemsize)
+        self.num_rows = min(lengths)
+        for name, dtype in self.columns.items():  # truncates the columns to the complete rows
+            with open(self.path / f"{name}.bin", "r+b") as file:
+                file.truncate(self.num_rows * np.dtype(dtype).itemsize)
+
+    def __len__(self):
+        return self.num_rows
+
+    def append(self, size, weight_rule, num_pattern, num_perturb, match_frac, num_trials):
+        """Appends the results of one cell of the sweep to the columns (and flushes them to the disk)"""
+
+        row = {"network_size": size, "weight_rule": weight_rule.encode(), "num_patterns": num_pattern,
+               "num_perturb": num_perturb, "match_frac": match_frac, "num_trials": num_trials}
+        for name, dtype in self.columns.items():
+            with open(self.path / f"{name}.bin", "ab") as file:
+                file.write(np.array(row[name], dtype=dtype).tobytes())
+        self.num_rows += 1
+
+    def check_settings(self, settings):
+        """Records the settings of the sweep appending to the store, or checks that they are the settings of the
+        stored rows
+
+        Parameters:
+        --------------
+        settings : dict
+        -> settings of the sweep which change its results (JSON-serializable values)
+
+        Output:
+        --------------
+        writes the settings in settings.json if the store is empty, and raises a ValueError if the stored rows were
+        computed with other settings
+        """
+
+        settings_path = self.path / "settings.json"
+        if self.num_rows > 0 and settings_path.is_file():
+            with open(settings_path) as file:
+                stored_settings = json.load(file)
+            if stored_settings != settings:
+                raise ValueError(f"The store {self.path} holds results computed with {stored_settings}, which "
+                                 f"cannot be resumed with {settings}.")
+            return
+        with open(settings_path, "w") as file:
+            json.dump(settings, file)
+
+    def column(self, name):
+        """Returns a column as a read-only memory-mapped array: the values are only read from the disk when used"""
+
+        if self.num_rows == 0:
+            return np.empty(0, dtype=self.columns[name])
+        return np.memmap(self.path / f"{name}.bin", dtype=self.columns[name], mode="r", shape=(self.num_rows,))
+
+    def results(self, weight_rule=None):
+        """Groups the stored rows by network size, learning rule and number of perturbations
+
+        Parameters:
+        --------------
+        weight_rule : string or None
+        -> if given, only the results of this learning rule are returned
+
+        Output:
+        --------------
+        returns a list with one dictionary "results_dict" per (size, weight_rule, num_perturb), in the format of the
+        results of the function "experiment" (the numbers of patterns being sorted), ordered by size, then by rule,
+        hebbian first, and then by number of perturbations
+        """
+
+        sizes, rules, perturbs = self.column("network_size"), self.column("weight_rule"), self.column("num_perturb")
+        keys = sorted(set(zip(sizes.tolist(), rules.tolist(), perturbs.tolist())),
+                      key=lambda key: (key[0], key[1] != b"hebbian", key[1], key[2]))
+        results = []
+        for size, rule, num_perturb in keys:
+            if weight_rule is not None and rule.decode() != weight_rule:
+                continue
+            rows = np.flatnonzero((sizes == size) & (rules == rule) & (perturbs == num_perturb))
+            rows = rows[np.argsort(self.column("num_patterns")[rows], kind="stable")]
+            results.append({"network_size": [size], "weight_rule": [rule.decode()],
+                            "num_patterns": self.column("num_patterns")[rows].tolist(),
+                            "num_perturb": [num_perturb],
+                            "match_frac": self.column("match_frac")[rows].tolist(),
+                            "num_trials": self.column("num_trials")[rows].tolist()})
+        return results
+
+
+class Tracer:
+
+    def __init__(self):
+        """Initialize a tracer recording one record (dictionary) per traced call of the networks it is passed to
+
+        A record has the keys "call" ("build_weights", "dynamics" or "dynamics_async"), "time" (total time of the
+        call, in seconds), "iterations", "flips", "check_time" (time spent checking the convergence),
+        "energy_time" (time spent in the saver, storing the states and computing or tracking their energy) and
+        the parameters of the call ("size", and "rule" and "num_patterns" for the construction of the weights).
+        The networks without tracer only pay a test per call.
+
+        Output:
+        --------------
+        Initialization of the attribute "records"
+        """
+
+        self.records = []
+
+    def start(self, call, **parameters):
+        """Returns a new record for a call, its clock being started"""
+
+        record = {"call": call, **parameters, "time": 0.0, "iterations": 0, "flips": 0, "check_time": 0.0,
+                  "energy_time": 0.0}
+        record["start"] = time.perf_counter()
+        return record
+
+    def stop(self, record):
+        """Stops the clock of a record and stores it"""
+
+        record["time"] = time.perf_counter() - record.pop("start")
+        self.records.append(record)
+
+    def summary(self, records=None):
+        """Aggregates records per type of call
+
+        Parameters:
+        --------------
+        records : list of dictionaries or None
+        -> records to aggregate (all the records of the tracer if None)
+
+        Output:
+        --------------
+        returns a dictionary with one entry per type of call, holding the number of calls ("calls") and the sums of
+        "time", "iterations", "flips", "check_time" and "energy_time"
+        """
+
+        summary = {}
+        for record in (self.records if records is None else records):
+            totals = summary.setdefault(record["call"], {"calls": 0, "time": 0.0, "iterations": 0, "flips": 0,
+                                                         "check_time": 0.0, "energy_time": 0.0})
+            totals["calls"] += 1
+            for key in ["time", "iterations", "flips", "check_time", "energy_time"]:
+                totals[key] += record[key]
+        return summary
+
+    def to_json(self, path):
+        """Exports the records as a JSON list"""
+
+        with open(path, "w") as file:
+            json.dump(self.records, file, indent=1)
+
+    def to_csv(self, path):
+        """Exports the records as a CSV table, one row per record"""
+
+        fieldnames = []
+        for record in self.records:
+            fieldnames += [key for key in record if key not in fieldnames]
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+
+class _TracedSaver:
+
+    def __init__(self, saver, record):
+        """Forwards everything to a saver, the time spent in store_iter and track_flips being added to a record"""
+
+        self.saver = saver
+        self.record = record
+
+    def __getattr__(self, name):
+        return getattr(self.saver, name)
+
+    def store_iter(self, *args, **kwargs):
+        start = time.perf_counter()
+        self.saver.store_iter(*args, **kwargs)
+        self.record["energy_time"] += time.perf_counter() - start
+
+    def track_flips(self, *args, **kwargs):
+        start = time.perf_counter()
+        self.saver.track_flips(*args, **kwargs)
+        self.record["energy_time"] += time.perf_counter() - start
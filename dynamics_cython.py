@@ -1,8 +1,10 @@
 from update_cython import*
+from kernels import kernel_inputs, local_fields, sync_update, async_steps
+from functions import state_key
 
 
-def dynamics(state, weights, max_iter):
-    """Runs the dynamical system from an initial state until convergence
+def dynamics(state, weights, max_iter, cycle_memory=8, return_cycle=False):
+    """Runs the dynamical system from an initial state until convergence, until it enters a limit cycle,
     or until a maximum number of steps is reached
     
     Parameters:
@@ -13,12 +15,17 @@ def dynamics(state, weights, max_iter):
     -> weights matrix
     max_iter : int
     -> maximum number of steps that can be reached
+    cycle_memory : int
+    -> number of recent states (kept as bit-packed keys) against which each new state is compared
+    return_cycle : bool
+    -> if True, the length of the cycle (1 for a fixed point) and the step at which it was entered are returned
+    too (None and None if no state was repeated)
     
     Output:
     --------------
-    returns the list of the state history
+    returns the list of the state history, up to the first repeated state
     
-    CU : max_iter >= 0
+    CU : max_iter >= 0 and cycle_memory > 0
 
     Examples:
     --------------
@@ -26,16 +33,37 @@ def dynamics(state, weights, max_iter):
     [array([1, 8, 0, 9]), array([1, 1, 1, 1]), array([1, 1, 1, 1])]
     """
     
+    inputs = kernel_inputs(state, weights)
+    if inputs is not None:
+        state_history, cycle = _dynamics_kernels(state, inputs[0], inputs[1], max_iter, cycle_memory)
+        return (state_history,) + cycle if return_cycle else state_history
     state_history = [state]
     previous_state = state.copy()
+    recent_steps = {}  # keys of the recent states -> steps at which they were reached
+    if np.all(np.abs(state) == 1):
+        recent_steps[state_key(state)] = 0
+    cycle = (None, None)
     for i in range(max_iter):
         new_state = update(previous_state, weights)  # updating the state
         state_history.append(new_state)  # adding the updated state to the state history list
-        if np.allclose(previous_state,
-                       new_state):  # verifies if the state before the update is equal to the updated state
-            break  # goes out of the for-loop because convergence is reached
+        cycle = _check_cycle(recent_steps, new_state, i + 1, cycle_memory)
+        if cycle[0] is not None:
+            break  # goes out of the for-loop because convergence (or a limit cycle) is reached
         previous_state = new_state.copy()  # iterative perspective of the dynamical evolution of the pattern
-    return state_history
+    return (state_history,) + cycle if return_cycle else state_history
+
+
+def _check_cycle(recent_steps, state, step, cycle_memory):
+    """Looks a new state up among the recent ones: returns the length and the entry step of the cycle if the state
+    was already reached, (None, None) otherwise, in which case the state is remembered"""
+
+    key = state_key(state)
+    if key in recent_steps:
+        return step - recent_steps[key], recent_steps[key]
+    recent_steps[key] = step
+    if len(recent_steps) > cycle_memory:
+        del recent_steps[next(iter(recent_steps))]  # forgetting the oldest state (insertion order)
+    return None, None
 
 
 def dynamics_async(state, weights, max_iter, convergence_num_iter):
@@ -65,6 +93,9 @@ def dynamics_async(state, weights, max_iter, convergence_num_iter):
    [array([-1, -1, -1,  1]), array([-1, -1, -1,  1])]
     """
     
+    inputs = kernel_inputs(state, weights)
+    if inputs is not None:
+        return _dynamics_async_kernels(state, inputs[0], inputs[1], max_iter, convergence_num_iter)
     state_history = [state]
     previous_state = state.copy()
     nb_iter = nb_iter_convergence = 0
@@ -78,3 +109,43 @@ def dynamics_async(state, weights, max_iter, convergence_num_iter):
         previous_state = new_state.copy()  # affecting the updated pattern to the previous one to perform the next updating step
         nb_iter += 1
     return state_history
+
+
+def _dynamics_kernels(state, state_int8, weights, max_iter, cycle_memory):
+    """Synchronous dynamics with the kernels: in-place updates into two alternating buffers, the convergence check
+    being the number of changed neurons returned by the kernel (the states being hashed only to detect longer cycles)"""
+
+    state_history = [state]
+    previous_state, new_state = state_int8, np.empty_like(state_int8)
+    recent_steps = {}
+    if np.all(np.abs(state) == 1):
+        recent_steps[state_key(state)] = 0
+    for i in range(max_iter):
+        changed = sync_update(weights, previous_state, new_state)
+        state_history.append(new_state.astype(state.dtype))
+        if changed == 0:
+            return state_history, (1, i)  # convergence is reached
+        cycle = _check_cycle(recent_steps, new_state, i + 1, cycle_memory)
+        if cycle[0] is not None:
+            return state_history, cycle
+        previous_state, new_state = new_state, previous_state
+    return state_history, (None, None)
+
+
+def _dynamics_async_kernels(state, state_int8, weights, max_iter, convergence_num_iter):
+    """Asynchronous dynamics with the kernels: the state is flipped in place and the local fields are kept up to date,
+    a step without flip counting as a convergence iteration"""
+
+    state_history = [state]
+    fields = np.empty(len(state_int8))
+    local_fields(weights, state_int8, fields)
+    columns = weights if np.array_equal(weights, weights.T) else np.ascontiguousarray(weights.T)  # contiguous rows
+    index = np.empty(1, dtype=np.intp)
+    nb_iter = nb_iter_convergence = 0
+    while (nb_iter < max_iter) and (nb_iter_convergence < convergence_num_iter):
+        index[0] = rd.randrange(len(state_int8))  # chooses randomly an index
+        if async_steps(columns, state_int8, fields, index) == 0:
+            nb_iter_convergence += 1
+        state_history.append(state_int8.astype(state.dtype))
+        nb_iter += 1
+    return state_history
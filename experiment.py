@@ -1,10 +1,13 @@
 from functions import *
 from classes import *
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 def experiment(size, num_patterns, weight_rule, num_perturb, successful_t_values, unsuccessful_t_values,
-               num_trials=10, max_iter=100):
+               num_trials=10, max_iter=100, rng=None, sequential=False, threshold=0.9, z=1.96,
+               tracer=None, min_trials=20):
     """Runs 10 trials for each network size by running the dynamical system varying the initial pattern and perturbing
     20% of the values of one of the original patterns.
 
@@ -26,11 +29,28 @@ def experiment(size, num_patterns, weight_rule, num_perturb, successful_t_values
     -> number of times we will repeat the experiment (here num_trials = 10)
     max_iter: int
     -> maximum of iterations used for the call of function "dynamics" (here max_iter = 100)
+    rng: numpy Generator
+    -> random generator used for the patterns and the perturbations (the global random states if None)
+    sequential: bool
+    -> if True, the trials of a number of patterns stop as soon as the pass/fail decision (match fraction >=
+    threshold) is reached: when the remaining trials cannot change it, or when the Wilson interval of the match
+    fraction lies on one side of the threshold (num_trials then being a cap)
+    threshold: float
+    -> minimal match fraction for a number of patterns to be successful
+    z: float
+    -> quantile of the standard normal distribution used for the Wilson intervals (1.96: 95% confidence)
+    tracer: Tracer or None
+    -> if given, the networks are traced (see Tracer) and the records of each number of patterns are aggregated
+    min_trials: int
+    -> number of trials run before the first look at the Wilson interval (sequential trials only): looking at it
+    after every trial from the first one misclassifies many more numbers of patterns than running all the trials
 
     Output:
     --------------
     returns a dictionary called "results_dict" which has the following keys : "network_size", "weight_rule",
-    "num_patterns", "num_perturb", "match_frac".
+    "num_patterns", "num_perturb", "match_frac", "num_trials" (number of trials actually run for each number of
+    patterns, the match fraction being computed over them), and "trace" if a tracer is given (one summary of the
+    records per number of patterns, see Tracer.summary).
 
     CU: size >= 0, num_patterns >=0, weight_rule = "Hebbian" or weight_rule = "Storkey",  num_perturb >=0,
     successful_t_values >=0, unsuccessful_t_values >=0, num_trials >=0 and max_iter >=0
@@ -38,7 +58,9 @@ def experiment(size, num_patterns, weight_rule, num_perturb, successful_t_values
 
     # definition of the dictionary
     results_dict = {"network_size": [], "weight_rule": [], "num_patterns": [],
-                    "num_perturb": [], "match_frac": []}
+                    "num_perturb": [], "match_frac": [], "num_trials": []}
+    if tracer is not None:
+        results_dict["trace"] = []
 
     # initialization of the network size, the weight rule and the number of perturbation in the dictionary
     # as they remain constant along the experiment
@@ -47,27 +69,35 @@ def experiment(size, num_patterns, weight_rule, num_perturb, successful_t_values
     results_dict["num_perturb"].append(num_perturb)
 
     for num_pattern in num_patterns:
-        patterns = generate_patterns(num_pattern, size)  # definition of a matrix of random patterns
-        network = HopfieldNetwork(patterns, weight_rule)  # definition of an HopfieldNetwork instance
+        patterns = generate_patterns(num_pattern, size, rng=rng)  # definition of a matrix of random patterns
+        num_records = 0 if tracer is None else len(tracer.records)
+        network = HopfieldNetwork(patterns, weight_rule, tracer=tracer)  # definition of an HopfieldNetwork instance
         # + computation of the weights matrix according to the learning rule done automatically
         # inside the class instance
         saver = DataSaver()
+        pattern_index = PatternIndex(patterns)  # built once per network, to look up the final states
 
-        convergence_nb = 0
+        convergence_nb = num_run = 0
         for j in range(num_trials):
-            index_perturbed = rd.randint(0, patterns.shape[0]-1)
-            perturbed_pattern = perturb_pattern(patterns[index_perturbed], num_perturb)  # perturbing one random pattern
-            # of the random pattern matrix
+            if rng is None:
+                index_perturbed = rd.randint(0, patterns.shape[0]-1)
+            else:
+                index_perturbed = int(rng.integers(0, patterns.shape[0]))
+            perturbed_pattern = perturb_pattern(patterns[index_perturbed], num_perturb, rng)  # perturbing one
+            # random pattern of the random pattern matrix
             network.dynamics(perturbed_pattern, saver, max_iter)  # running the dynamical evolution system on all
             # perturbed patterns
             network_evolution = saver.get_data()["state"]  # accessing the list containing all the evolutions
             # of each perturbed pattern
 
-            if pattern_match(patterns, network_evolution[-1]) == index_perturbed:
+            if pattern_index.match(network_evolution[-1]) == index_perturbed:
                 convergence_nb += 1
+            num_run += 1
+            if sequential and _decided(convergence_nb, num_run, num_trials, threshold, z, min_trials):
+                break  # the remaining trials are not needed to decide
 
-        convergence_fraction = (convergence_nb / num_trials)  # computation of the convergence fraction
-        if convergence_fraction >= 0.9:  # determining if the system has successfully converged + storing the
+        convergence_fraction = (convergence_nb / num_run)  # computation of the convergence fraction
+        if convergence_fraction >= threshold:  # determining if the system has successfully converged + storing the
             # number of patterns in the corresponding list
             successful_t_values.append(num_pattern)
         else:
@@ -76,10 +106,301 @@ def experiment(size, num_patterns, weight_rule, num_perturb, successful_t_values
         # storing the number of patterns and the convergence fraction in the dictionary
         results_dict["num_patterns"].append(num_pattern)
         results_dict["match_frac"].append(convergence_fraction)
+        results_dict["num_trials"].append(num_run)
+        if tracer is not None:
+            results_dict["trace"].append(tracer.summary(tracer.records[num_records:]))
 
     return results_dict
 
 
+def _decided(successes, trials, num_trials, threshold, z, min_trials=20):
+    """Returns whether the pass/fail decision of a number of patterns is reached after some of its trials (the Wilson
+    interval being only looked at after min_trials trials)"""
+
+    if successes / num_trials >= threshold or (successes + num_trials - trials) / num_trials < threshold:
+        return True  # the remaining trials cannot change the decision
+    if trials < min_trials:
+        return False
+    lower, upper = wilson_interval(successes, trials, z)
+    return lower >= threshold or upper < threshold
+
+
+def theoretical_capacity(size, weight_rule):
+    """Returns the asymptotic estimate of the capacity: N / (2 ln N) with the hebbian rule, N / sqrt(2 ln N) with
+    the storkey rule"""
+
+    if weight_rule == "hebbian":
+        return size / (2 * math.log(size))
+    return size / math.sqrt(2 * math.log(size))
+
+
+def _evaluate_cell(size, num_pattern, weight_rule, num_perturb, outcomes, num_trials, max_trials, max_iter, threshold,
+                   z, rng):
+    """Runs batches of num_trials trials (one network each) on a number of patterns until the Wilson interval of its
+    match fraction excludes the threshold or max_trials trials are reached; returns whether it passes the threshold"""
+
+    successes, trials = outcomes.get(num_pattern, (0, 0))
+    while trials < max_trials:
+        results_dict = experiment(size, [num_pattern], weight_rule, num_perturb, [], [], num_trials, max_iter, rng)
+        successes += round(results_dict["match_frac"][0] * results_dict["num_trials"][0])
+        trials += results_dict["num_trials"][0]
+        lower, upper = wilson_interval(successes, trials, z)
+        if lower >= threshold or upper < threshold:
+            break  # the pass/fail decision is confident enough
+    outcomes[num_pattern] = (successes, trials)
+    return successes / trials >= threshold
+
+
+def capacity_search(size, weight_rule, num_perturb=None, num_trials=10, max_trials=None, max_iter=100, threshold=0.9,
+                    resolution=None, z=1.96, rng=None):
+    """Locates the capacity (largest number of patterns retrieved with a fraction of at least threshold) by a noisy
+    binary search between 0.5 and 2 times the theoretical capacity, instead of evaluating a fixed grid
+
+    Parameters:
+    --------------
+    size : int
+    -> size of the network
+    weight_rule: string
+    -> learning rule ("hebbian" or "storkey")
+    num_perturb: int or None
+    -> number of perturbations applied to the probes (20% of the neurons if None)
+    num_trials: int
+    -> number of trials run on each network
+    max_trials: int or None
+    -> maximum number of trials per number of patterns: batches of num_trials trials are run on new networks until
+    the Wilson interval of the match fraction lies on one side of the threshold (5 * num_trials if None, a single
+    batch of 10 successes out of 10 being too few to confidently pass a threshold of 0.9)
+    max_iter: int
+    -> maximum of iterations used for the call of function "dynamics"
+    threshold: float
+    -> minimal match fraction of a number of patterns within the capacity
+    resolution: int or None
+    -> the search stops when the capacity is bracketed within resolution patterns (5% of the theoretical capacity
+    if None)
+    z: float
+    -> quantile of the standard normal distribution used for the Wilson intervals (1.96: 95% confidence)
+    rng: numpy Generator
+    -> random generator used for the patterns and the perturbations (the global random states if None)
+
+    Output:
+    --------------
+    returns a dictionary "results_dict" with the keys of the results of the function "experiment" (the evaluated
+    numbers of patterns being sorted), plus "capacity" (largest number of patterns passing the threshold, the next
+    evaluated one failing it), "confidence_interval" (from the largest number of patterns confidently passing to the
+    smallest one confidently failing minus one, according to the Wilson intervals, None if no number of patterns
+    confidently fails), "num_trials" (trials run on each number of patterns) and "num_networks" (number of networks
+    built)
+
+    CU: size >= 2, num_trials > 0, max_trials is None or max_trials >= num_trials, and 0 < threshold < 1
+    """
+
+    num_perturb = int(0.2 * size) if num_perturb is None else num_perturb
+    max_trials = 5 * num_trials if max_trials is None else max_trials
+    capacity = theoretical_capacity(size, weight_rule)
+    resolution = max(1, int(0.05 * capacity)) if resolution is None else resolution
+    low, high = max(1, int(0.5 * capacity)), max(2, int(2 * capacity))
+    outcomes = {}  # number of patterns -> (successes, trials)
+    arguments = (weight_rule, num_perturb, outcomes, num_trials, max_trials, max_iter, threshold, z, rng)
+
+    while True:
+        while high - low > resolution:
+            middle = (low + high) // 2
+            if _evaluate_cell(size, middle, *arguments):
+                low = middle
+            else:
+                high = middle
+        # the ends of the bracket are only evaluated once the search has stayed on one of its sides
+        if low not in outcomes and not _evaluate_cell(size, low, *arguments):
+            if low == 1:
+                low = 0  # even a single pattern is not retrieved
+                break
+            low, high = max(1, low // 2), low  # the capacity is below the bracket
+        elif high not in outcomes and _evaluate_cell(size, high, *arguments):
+            low, high = high, 2 * high  # the capacity is above the bracket
+        else:
+            break
+
+    num_patterns = sorted(outcomes)
+    bounds = {num_pattern: wilson_interval(*outcomes[num_pattern], z) for num_pattern in num_patterns}
+    confident_passes = [num_pattern for num_pattern in num_patterns if bounds[num_pattern][0] >= threshold]
+    confident_fails = [num_pattern for num_pattern in num_patterns if bounds[num_pattern][1] < threshold]
+    return {"network_size": [size], "weight_rule": [weight_rule], "num_patterns": num_patterns,
+            "num_perturb": [num_perturb],
+            "match_frac": [outcomes[num_pattern][0] / outcomes[num_pattern][1] for num_pattern in num_patterns],
+            "capacity": [low],
+            "confidence_interval": [(max(confident_passes, default=0),
+                                     min(confident_fails) - 1 if confident_fails else None)],
+            "num_trials": [outcomes[num_pattern][1] for num_pattern in num_patterns],
+            "num_networks": [sum(outcomes[num_pattern][1] for num_pattern in num_patterns) // num_trials]}
+
+
+def sweep_cells(sizes, weight_rules=("hebbian", "storkey")):
+    """Builds the configurations of the capacity sweep: 10 numbers of patterns between 0.5 and 2 times the
+    theoretical capacity of each network size and learning rule, 20% of the neurons being perturbed
+
+    Parameters:
+    --------------
+    sizes: list of ints
+    -> sizes of the networks
+    weight_rules: tuple of strings
+    -> learning rules ("hebbian" and/or "storkey")
+
+    Output:
+    --------------
+    returns a list of tuples (size, weight_rule, num_patterns, num_perturb), num_patterns being a list of ints
+
+    CU: size >= 2
+    """
+
+    cells = []
+    for size in sizes:
+        for weight_rule in weight_rules:
+            capacity = theoretical_capacity(size, weight_rule)
+            num_patterns = np.linspace(0.5 * capacity, 2 * capacity, 10).astype(int)
+            cells.append((int(size), weight_rule, [int(num_pattern) for num_pattern in num_patterns], int(0.2 * size)))
+    return cells
+
+
+def _limit_blas_threads():
+    """Initializer of the worker processes: their BLAS runs on one thread, the pool already using every processor"""
+
+    for name in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[name] = "1"  # read by a BLAS loaded after this point
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(1)  # BLAS already loaded (workers forked from a process which used NumPy)
+
+
+def _experiment_cell(task):
+    """Runs the experiment for a single (size, weight_rule, num_pattern) cell with its own random stream
+    (top-level function so that it can be sent to a process pool)"""
+
+    size, weight_rule, num_pattern, num_perturb, num_trials, max_iter, sequential, seed = task
+    results_dict = experiment(size, [num_pattern], weight_rule, num_perturb, [], [], num_trials, max_iter,
+                              rng=np.random.default_rng(seed), sequential=sequential)
+    return results_dict["match_frac"][0], results_dict["num_trials"][0]
+
+
+def parallel_experiment(cells, num_trials=10, max_iter=100, seed=None, max_workers=None, sequential=False,
+                        store=None):
+    """Runs the experiment on all the cells of a sweep in a process pool, each (size, weight_rule, num_pattern)
+    cell getting an independent and reproducible random stream
+
+    Parameters:
+    --------------
+    cells: list of tuples
+    -> configurations (size, weight_rule, num_patterns, num_perturb) of the sweep, as returned by sweep_cells
+    num_trials: int
+    -> number of times we will repeat the experiment for each cell
+    max_iter: int
+    -> maximum of iterations used for the call of function "dynamics"
+    seed: int or None
+    -> seed from which the random streams of all the cells are derived (the same seed gives the same results)
+    max_workers: int or None
+    -> number of worker processes (the number of processors if None), each running its BLAS on one thread
+    sequential: bool
+    -> if True, the trials of each cell stop as soon as its pass/fail decision is reached (see experiment)
+    store: ResultsStore or None
+    -> if given, each (size, weight_rule, num_pattern) cell is appended to the store as soon as it is finished, and
+    the cells already in the store (with the same number of perturbations) are skipped: an interrupted sweep is
+    resumed by running it again with the same store, and a ValueError is raised if num_trials, max_iter, seed or
+    sequential differ from the settings of the stored results
+
+    Output:
+    --------------
+    returns a list with one dictionary "results_dict" per configuration, in the same format and order as the
+    results of the function "experiment"
+
+    CU: num_trials > 0 and max_iter >= 0
+    """
+
+    tasks = [(size, weight_rule, num_pattern, num_perturb, num_trials, max_iter, sequential)
+             for size, weight_rule, num_patterns, num_perturb in cells for num_pattern in num_patterns]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))  # one independent stream per cell
+    outcomes = {}  # (size, weight_rule, num_pattern, num_perturb) -> (match_frac, num_trials)
+    if store is not None:
+        store.check_settings({"num_trials": int(num_trials), "max_iter": int(max_iter),
+                              "seed": None if seed is None else int(seed), "sequential": bool(sequential)})
+        stored_rows = zip(*[store.column(name).tolist() for name in store.columns])
+        for size, weight_rule, num_pattern, num_perturb, match_frac, trials in stored_rows:
+            outcomes[(size, weight_rule.decode(), num_pattern, num_perturb)] = (match_frac, trials)
+    pending = {}
+    for task, seed in zip(tasks, seeds):
+        if task[:4] not in outcomes and task[:4] not in pending:  # cells already stored or repeated are skipped
+            pending[task[:4]] = task + (seed,)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_limit_blas_threads) as executor:
+        futures = {executor.submit(_experiment_cell, task): task for task in pending.values()}
+        for future in as_completed(futures):
+            task = futures[future]
+            outcomes[task[:4]] = future.result()
+            if store is not None:
+                store.append(*task[:4], *outcomes[task[:4]])  # written as soon as the cell is finished
+
+    results = []
+    for size, weight_rule, num_patterns, num_perturb in cells:
+        cell_outcomes = [outcomes[(size, weight_rule, num_pattern, num_perturb)] for num_pattern in num_patterns]
+        results.append({"network_size": [size], "weight_rule": [weight_rule], "num_patterns": list(num_patterns),
+                        "num_perturb": [num_perturb], "match_frac": [outcome[0] for outcome in cell_outcomes],
+                        "num_trials": [outcome[1] for outcome in cell_outcomes]})
+    return results
+
+
+def robustness_experiment(size, num_patterns, weight_rule, num_perturbs=None, num_trials=10, max_iter=100,
+                          rng=None):
+    """Measures the fraction of retrieved patterns for several numbers of perturbations with a single network,
+    the probes of all the perturbation levels and trials being recalled together as one batch
+
+    Parameters:
+    --------------
+    size : int
+    -> size of the network
+    num_patterns: int
+    -> number of patterns memorized by the network
+    weight_rule: string
+    -> learning rule ("hebbian" or "storkey")
+    num_perturbs: list of ints or None
+    -> numbers of perturbations of the probes ((np.linspace(0, 1, 20) * size).astype(int) if None)
+    num_trials: int
+    -> number of probes per number of perturbations, each perturbing a randomly chosen pattern
+    max_iter: int
+    -> maximum of iterations of the synchronous dynamics of the probes
+    rng: numpy Generator
+    -> random generator used for the patterns and the probes (a new one if None)
+
+    Output:
+    --------------
+    returns a dictionary "results_dict" with the keys "network_size", "weight_rule", "num_patterns",
+    "num_perturb" (the numbers of perturbations), "match_frac" (fraction of retrieved patterns for each of them) and
+    "num_trials"
+
+    CU: size > 0, num_patterns > 0, 0 <= num_perturb <= size, num_trials > 0 and max_iter >= 0
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+    num_perturbs = (np.linspace(0, 1, 20) * size).astype(int) if num_perturbs is None else np.asarray(num_perturbs)
+    patterns = generate_patterns(num_patterns, size, rng=rng)
+    network = HopfieldNetwork(patterns, weight_rule)  # built once for all the perturbation levels
+
+    # one probe per (level, trial): the perturbed positions are drawn with replacement, as in perturb_pattern
+    levels = np.repeat(num_perturbs, num_trials)
+    indices_perturbed = rng.integers(0, num_patterns, size=levels.size)
+    positions = rng.integers(0, size, size=(levels.size, max(int(num_perturbs.max()), 1)))
+    rows, columns = np.nonzero(np.arange(positions.shape[1]) < levels[:, np.newaxis])  # the first levels[i] draws
+    flipped = np.zeros((levels.size, size), dtype=bool)
+    flipped[rows, positions[rows, columns]] = True
+    probes = np.where(flipped, -patterns[indices_perturbed], patterns[indices_perturbed])
+
+    states, iterations, converged = network.recall_batch(probes, max_iter)
+    retrieved = PatternIndex(patterns).match_batch(states) == indices_perturbed
+    match_frac = retrieved.reshape(len(num_perturbs), num_trials).mean(axis=1)
+    return {"network_size": [size], "weight_rule": [weight_rule], "num_patterns": [num_patterns],
+            "num_perturb": [int(num_perturb) for num_perturb in num_perturbs],
+            "match_frac": [float(fraction) for fraction in match_frac],
+            "num_trials": [num_trials] * len(num_perturbs)}
+
+
 def comparison_asymptotic_estimate_and_experimental_capacity(size, weight_rule, experimental_capacity,
                                                              asymptotic_estimate):
     """Compares the experimental network capacity to the theoretical asymptotic estimate.
@@ -143,6 +464,8 @@ def plot_capacity_curve(size, weight_rule, num_patterns, match_frac):
     CU: size >= 0, weight_rule = "Hebbian" or weight_rule = "Storkey", num_patterns >=0, match_frac >= 0
     """
     
+    import matplotlib.pyplot as plt  # imported on first use only
+
     # formatting of the figure
     plt.figure(figsize=(10, 6))
     plt.ylim(-0.1, 1.1)
@@ -160,6 +483,38 @@ def plot_capacity_curve(size, weight_rule, num_patterns, match_frac):
     plt.close()
 
 
+def plot_robustness_curve(size, weight_rule, num_perturb, match_frac):
+    """Plots the robustness curve (fraction of retrieved patterns vs. number of perturbations) for a given size of
+    simulated network and learning rule, as returned by robustness_experiment
+
+    Parameters:
+    --------------
+    size: int
+    -> size of the network (= size of the patterns of the network)
+    weight_rule: string
+    -> learning rule used by the network ("hebbian" or "storkey")
+    num_perturb: list of ints
+    -> numbers of perturbations of the probes
+    match_frac: list of floating points
+    -> fraction of retrieved patterns for each number of perturbations
+
+    Output:
+    --------------
+    robustness curve saved in the current directory
+    """
+
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.ylim(-0.1, 1.1)
+    plt.xlabel("Number of perturbations")
+    plt.ylabel("Fraction of retrieved patterns")
+    plt.title(f"Robustness curve for a network of size {size} with the {weight_rule} rule")
+    plt.plot(num_perturb, match_frac, marker="o")
+    plt.savefig(f"Size{size}_Rule{weight_rule}_RobustnessCurve", format="jpg")
+    plt.close()
+
+
 def plot_empirical_capacity(size, num_patterns, match_frac, color):
     """Plots empirical capacity curves including number of neurons vs. capacity (defined as the number of patterns that 
     can be retrieved with a probability higher than 90%).
@@ -183,6 +538,8 @@ def plot_empirical_capacity(size, num_patterns, match_frac, color):
     CU: size >=0, num_patterns >=0 and match_frac >=0
     """
 
+    import matplotlib.pyplot as plt
+
     max_nb_patterns = 0
     for j in range(len(match_frac)):  # determine for which higher number of patterns we have a system's convergence
         if match_frac[j] >= 0.9 and num_patterns[j] >= max_nb_patterns:
@@ -209,6 +566,8 @@ def save_empirical_capacity(results, rule):
     empirical capacity curve saved in the current directory
     """
 
+    import matplotlib.pyplot as plt
+
     # formatting the figure
     plt.figure(figsize=(10, 7))
     plt.xlabel("Number of Neurons")
@@ -1,8 +1,12 @@
 import numpy as np
 import random as rd
+import hashlib
+import io
+import os
+from pathlib import Path
 
 
-def generate_patterns(num_patterns, pattern_size):
+def generate_patterns(num_patterns, pattern_size, dtype=np.int8, rng=None):
     """Generates random binary patterns that will be memorized
     
     Parameters:
@@ -11,6 +15,10 @@ def generate_patterns(num_patterns, pattern_size):
     -> number of patterns we want to generate.
     pattern_size : int
     -> size of the patterns we want to generate
+    dtype : numpy dtype
+    -> dtype of the patterns (int8 by default, which is enough to hold -1 and 1)
+    rng : numpy Generator
+    -> random generator to draw the patterns from (the global numpy random state if None)
     
     Output:
     --------------
@@ -19,11 +27,12 @@ def generate_patterns(num_patterns, pattern_size):
     CU : num_patterns >= 0 and pattern_size >= 0
     """
     
-    return np.random.choice([-1, 1], size=(num_patterns, pattern_size))  # generates 2-dimensional numpy array
-    # in which each row is a random binary pattern
+    rng = np.random if rng is None else rng
+    return rng.choice(np.array([-1, 1], dtype=dtype), size=(num_patterns, pattern_size))  # generates
+    # 2-dimensional numpy array in which each row is a random binary pattern
 
 
-def perturb_pattern(pattern, num_perturb):
+def perturb_pattern(pattern, num_perturb, rng=None):
     """Randomly perturbs a given number of times a pattern (changes the sign of its elements)
     
     Parameters:
@@ -32,6 +41,8 @@ def perturb_pattern(pattern, num_perturb):
     -> pattern we want to be perturbed
     num_perturb : int
     -> number of elements from "pattern" we want to be perturbed
+    rng : numpy Generator
+    -> random generator to draw the perturbed elements from (the global random state if None)
     
     Output:
     --------------
@@ -41,8 +52,11 @@ def perturb_pattern(pattern, num_perturb):
     """
     
     pattern_perturbed = pattern.copy()
-    indices = rd.choices(np.linspace(0, len(pattern) - 1, len(pattern), dtype=int), k=num_perturb)  # chooses randomly
-    # an index to perturb a random element of one given pattern
+    if rng is None:
+        indices = rd.choices(np.linspace(0, len(pattern) - 1, len(pattern), dtype=int), k=num_perturb)  # chooses
+        # randomly an index to perturb a random element of one given pattern
+    else:
+        indices = rng.integers(0, len(pattern), size=num_perturb)
     pattern_perturbed[indices] = -pattern_perturbed[indices]  # inverse the sign of a single element of a given pattern
     return pattern_perturbed
 
@@ -68,10 +82,22 @@ def pattern_match(memorized_patterns, pattern):
     0
     """
     
-    for index in range(0, memorized_patterns.shape[0]):
-        if np.allclose(memorized_patterns[index], pattern):  # verifies if the pattern passed in parameters match
-            # to one of the memorized patterns
-            return index
+    matches = np.flatnonzero(np.all(np.isclose(memorized_patterns, pattern), axis=1))  # verifies in one pass if
+    # the pattern passed in parameters match to one of the memorized patterns
+    if matches.size > 0:
+        return int(matches[0])
+
+
+def state_key(state):
+    """Returns a compact hashable key of a state (its neurons packed as bits), used to detect repeated states
+
+    Examples:
+    --------------
+    >>> state_key(np.array([1, -1, -1, 1, 1, 1, -1, -1, 1]))
+    b'\\x9c\\x80'
+    """
+
+    return np.packbits(np.asarray(state) > 0).tobytes()
 
 
 def create_checkerboard():
@@ -95,3 +121,473 @@ def create_checkerboard():
     
     return checkerboard
     
+
+
+def storkey_weights_incremental(patterns, weights=None):
+    """Creates the weights matrix with the storkey learning rule, folding in one pattern at a time in O(N^2)
+
+    For a binary pattern p, the storkey update only needs the local fields v = W_h.p (W_h being the weights matrix
+    with a zeroed diagonal): the off-diagonal part of the matrix is scaled by (1 + 2/N) and receives the rank-2
+    update ((p - v).p^T - p.v^T) / N, while the diagonal receives (p^2 - 2.v.p) / N.
+
+    Parameters:
+    --------------
+    patterns : array
+    -> binary patterns (-1 or 1) to which the storkey learning rule will be applied
+    weights : array
+    -> weights matrix to start from (optional), updated in place when given
+
+    Output:
+    --------------
+    returns the weights matrix (a multi-dimensional numpy array)
+
+    CU : the elements of the patterns are either -1 or 1
+
+    Examples:
+    --------------
+    >>> storkey_weights_incremental(np.array([[1, 1, -1, -1], [1, 1, -1, 1], [-1, 1, -1, 1]]))
+    array([[ 1.125,  0.25 , -0.25 , -0.5  ],
+           [ 0.25 ,  0.625, -1.   ,  0.25 ],
+           [-0.25 , -1.   ,  0.625, -0.25 ],
+           [-0.5  ,  0.25 , -0.25 ,  1.125]])
+    """
+
+    size = patterns.shape[1]
+    if weights is None:
+        weights = np.zeros([size, size])
+    for pattern in patterns.astype(weights.dtype):
+        diagonal = np.diagonal(weights).copy()
+        np.fill_diagonal(weights, 0)
+        fields = np.dot(weights, pattern)  # local fields computed without the self-connections
+        weights *= 1 + 2 / size
+        weights += np.outer(pattern - fields, pattern / size)  # rank-2 update of the off-diagonal part
+        weights -= np.outer(pattern, fields / size)
+        np.fill_diagonal(weights, diagonal + (pattern * pattern - 2 * fields * pattern) / size)
+    return weights
+
+
+def _storkey_block(fields_0, block, diagonal):
+    """Computes the local fields of a block of patterns learnt one after the other with the storkey rule
+
+    Parameters:
+    --------------
+    fields_0 : array
+    -> local fields W_h.p of every pattern of the block (one column per pattern) before the block is learnt
+    block : array
+    -> binary patterns of the block (one row per pattern)
+    diagonal : array
+    -> diagonal of the weights matrix before the block is learnt
+
+    Output:
+    --------------
+    returns the local fields seen by each pattern of the block when it is learnt (one row per pattern), the
+    coefficients of their rank-2 updates and the diagonal of the weights matrix once the block is learnt
+    """
+
+    num_block, size = block.shape
+    scale = 1 + 2 / size
+    fields = np.empty((num_block, size))
+    coefficients = scale ** np.arange(num_block - 1, -1, -1) / size
+    for k in range(num_block):
+        pattern = block[k]
+        field = scale ** k * fields_0[:, k]
+        if k > 0:
+            previous_patterns = block[:k]
+            previous_fields = fields[:k]
+            weight = scale ** np.arange(k - 1, -1, -1) / size  # scaling undergone by each earlier update
+            overlaps = np.dot(previous_patterns, pattern) * weight
+            cross_overlaps = np.dot(previous_fields, pattern) * weight
+            field += np.dot(overlaps, previous_patterns - previous_fields) - np.dot(cross_overlaps, previous_patterns)
+            field -= np.dot(weight, previous_patterns * previous_patterns
+                            - 2 * previous_fields * previous_patterns) * pattern  # no self-connections
+        fields[k] = field
+    diagonal = diagonal + (np.sum(block * block, axis=0) - 2 * np.sum(fields * block, axis=0)) / size
+    return fields, coefficients, diagonal
+
+
+def storkey_weights_blocked(patterns, block_size=64, weights=None):
+    """Creates the weights matrix with the storkey learning rule, folding in a block of patterns per matrix product
+
+    The local fields of a whole block are obtained with a single product W_h.P_block^T, and the block is then
+    applied to the weights matrix as a single rank-2B update, so that each pattern still costs O(N^2).
+
+    Parameters:
+    --------------
+    patterns : array
+    -> binary patterns (-1 or 1) to which the storkey learning rule will be applied
+    block_size : int
+    -> number of patterns folded in per matrix product
+    weights : array
+    -> weights matrix to start from (optional), updated in place when given
+
+    Output:
+    --------------
+    returns the weights matrix (a multi-dimensional numpy array)
+
+    CU : the elements of the patterns are either -1 or 1 and block_size > 0
+
+    Examples:
+    --------------
+    >>> storkey_weights_blocked(np.array([[1, 1, -1, -1], [1, 1, -1, 1], [-1, 1, -1, 1]]), block_size=2)
+    array([[ 1.125,  0.25 , -0.25 , -0.5  ],
+           [ 0.25 ,  0.625, -1.   ,  0.25 ],
+           [-0.25 , -1.   ,  0.625, -0.25 ],
+           [-0.5  ,  0.25 , -0.25 ,  1.125]])
+    """
+
+    size = patterns.shape[1]
+    if weights is None:
+        weights = np.zeros([size, size])
+    patterns = patterns.astype(weights.dtype)
+    for start in range(0, patterns.shape[0], block_size):
+        block = patterns[start:start + block_size]
+        diagonal = np.diagonal(weights).copy()
+        np.fill_diagonal(weights, 0)
+        fields, coefficients, diagonal = _storkey_block(np.dot(weights, block.T), block, diagonal)
+        weights *= (1 + 2 / size) ** block.shape[0]
+        weights += np.dot(((block - fields) * coefficients[:, None]).T, block)  # rank-2B update of the weights
+        weights -= np.dot((block * coefficients[:, None]).T, fields)
+        np.fill_diagonal(weights, diagonal)
+    return weights
+
+
+def diluted_connections(size, degree, connectivity="random", rng=None):
+    """Draws the connections of a diluted network, in CSR form (the row i lists the neurons connected to i)
+
+    Parameters:
+    --------------
+    size : int
+    -> number of neurons
+    degree : int
+    -> mean number of connections per neuron ("random") or exact number of inputs per neuron ("fixed")
+    connectivity : string
+    -> "random" for a symmetric random dilution (each pair of neurons is connected with probability close to
+    degree / (size - 1)), "fixed" for exactly degree inputs per neuron drawn at random (non symmetric)
+    rng : numpy Generator
+    -> random generator used to draw the connections (a fresh one if None)
+
+    Output:
+    --------------
+    returns the arrays indptr (size + 1 row pointers) and indices (sorted column indices of each row)
+
+    CU: 0 < degree < size, and connectivity = "random" or connectivity = "fixed"; no neuron is connected to itself
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+    if connectivity == "fixed":
+        rows = np.repeat(np.arange(size, dtype=np.int64), degree)
+        columns = rng.integers(0, size - 1, size=len(rows))
+        columns += columns >= rows  # skipping the neuron itself
+        keys = rows * size + columns
+        keys.sort()
+        duplicated = np.flatnonzero(np.diff(keys) == 0)
+        while len(duplicated) > 0:  # rare for degree << size: draws the duplicated inputs again
+            rows = keys[duplicated] // size
+            columns = rng.integers(0, size - 1, size=len(rows))
+            keys[duplicated] = rows * size + columns + (columns >= rows)
+            keys.sort()
+            duplicated = np.flatnonzero(np.diff(keys) == 0)
+    else:
+        num_pairs = rng.binomial(size * (size - 1) // 2, degree / (size - 1))
+        first = rng.integers(0, size, size=num_pairs)
+        second = rng.integers(0, size - 1, size=num_pairs)
+        second += second >= first
+        keys = np.minimum(first, second) * size + np.maximum(first, second)  # pairs i < j
+        keys.sort()
+        keys = keys[np.concatenate(([True], np.diff(keys) != 0))]  # a pair drawn twice is only connected once
+        keys = np.concatenate((keys, (keys % size) * size + keys // size))  # both directions of each pair
+        keys.sort()
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(keys // size, minlength=size))))
+    return indptr, keys % size
+
+
+def hebbian_weights_diluted(patterns, indptr, indices, dtype=np.float64, chunk_size=2 ** 22):
+    """Creates the kept weights of a diluted network with the hebbian learning rule
+
+    Parameters:
+    --------------
+    patterns : array
+    -> patterns to which the hebbian learning rule will be applied
+    indptr, indices : arrays
+    -> connections of the network in CSR form (see diluted_connections)
+    dtype : numpy dtype
+    -> dtype of the weights; with an integer dtype, the exact counts are returned without the 1/P scale
+    chunk_size : int
+    -> maximum number of pattern elements gathered at once (bounds the temporary memory)
+
+    Output:
+    --------------
+    returns the weights of the kept connections, in the order of indices (a numpy array)
+    """
+
+    dtype = np.dtype(dtype)
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    data = np.empty(len(indices), dtype=dtype)
+    step = max(1, chunk_size // max(patterns.shape[0], 1))
+    for start in range(0, len(indices), step):  # only the kept entries are computed, by chunks of connections
+        end = start + step
+        data[start:end] = np.einsum("ij,ij->j", patterns[:, rows[start:end]].astype(np.float32),
+                                    patterns[:, indices[start:end]].astype(np.float32))
+    if not np.issubdtype(dtype, np.integer):
+        data /= patterns.shape[0]
+    return data
+
+
+def storkey_weights_diluted(patterns, indptr, indices, data=None):
+    """Creates the kept weights of a diluted network with the storkey learning rule, in O(N.K) per pattern
+
+    The local fields h_ij only sum over the kept connections of the neuron i, so that with all the connections kept
+    the weights are the off-diagonal weights of the dense storkey rule.
+
+    Parameters:
+    --------------
+    patterns : array
+    -> binary patterns (-1 or 1) to which the storkey learning rule will be applied
+    indptr, indices : arrays
+    -> connections of the network in CSR form (see diluted_connections)
+    data : array
+    -> weights of the kept connections to start from (optional), updated in place when given
+
+    Output:
+    --------------
+    returns the weights of the kept connections, in the order of indices (a numpy array)
+
+    CU : the elements of the patterns are either -1 or 1
+    """
+
+    size = len(indptr) - 1
+    degrees = np.diff(indptr)
+    rows = np.repeat(np.arange(size), degrees)
+    if data is None:
+        data = np.zeros(len(indices))
+    keys = rows.astype(np.int64) * size + indices  # sorted, as the rows and the columns of each row are sorted
+    transposed_keys = indices.astype(np.int64) * size + rows
+    order = np.argsort(transposed_keys)  # searching sorted keys is much more cache friendly
+    transposed = np.empty(len(keys), dtype=np.int64)
+    transposed[order] = np.minimum(np.searchsorted(keys, transposed_keys[order]), max(len(keys) - 1, 0))
+    has_transposed = keys[transposed] == transposed_keys  # the connection j -> i is also kept
+    for pattern in patterns.astype(np.float64):
+        pattern_i, pattern_j = np.repeat(pattern, degrees), pattern[indices]
+        contributions = data * pattern_j
+        fields = np.bincount(rows, weights=contributions, minlength=size)  # v = W.p over the kept entries
+        fields_ij = np.repeat(fields, degrees) - contributions
+        fields_ji = fields[indices] - np.where(has_transposed, data[transposed], 0) * pattern_i
+        data += (pattern_i * pattern_j - pattern_i * fields_ji - fields_ij * pattern_j) / size
+    return data
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """Computes the Wilson score interval of a success probability estimated from Bernoulli trials
+
+    Parameters:
+    --------------
+    successes: int
+    -> number of successful trials
+    trials: int
+    -> number of trials
+    z: float
+    -> quantile of the standard normal distribution (1.96 for a 95% confidence interval)
+
+    Output:
+    --------------
+    returns the lower and upper bounds of the interval (floats between 0 and 1)
+
+    CU: 0 <= successes <= trials and trials > 0
+
+    Examples:
+    --------------
+    >>> [round(bound, 3) for bound in wilson_interval(9, 10)]
+    [0.596, 0.982]
+    """
+
+    center = (successes + z ** 2 / 2) / (trials + z ** 2)
+    half_width = z / (trials + z ** 2) * np.sqrt(successes * (trials - successes) / trials + z ** 2 / 4)
+    return float(max(center - half_width, 0.0)), float(min(center + half_width, 1.0))
+
+
+def hebbian_weights_out_of_core(patterns, weights, memory_budget=2 ** 28):
+    """Fills a (memory-mapped) weights matrix with the hebbian learning rule by blocks of rows, streaming the
+    patterns through each block, so that the matrix is never held in memory
+
+    Parameters:
+    --------------
+    patterns : array
+    -> patterns to which the hebbian learning rule will be applied (one pattern per row)
+    weights : array
+    -> N x N output array, typically a np.memmap: floating (W = P^T.P / M) or integer (exact counts P^T.P)
+    memory_budget : int
+    -> approximate number of bytes that the temporary blocks can use
+
+    Output:
+    --------------
+    writes the weights matrix (with a zeroed diagonal) into weights
+
+    CU: memory_budget > 0
+    """
+
+    num_patterns, size = patterns.shape
+    pattern_rows = min(num_patterns, max(1, memory_budget // 4 // (8 * size)))  # a quarter for the patterns
+    rows_per_block = max(1, (memory_budget - 8 * pattern_rows * size) // (16 * size))  # block + product
+    for start in range(0, size, rows_per_block):
+        end = min(start + rows_per_block, size)
+        block = np.zeros((end - start, size))
+        for first in range(0, num_patterns, pattern_rows):
+            chunk = patterns[first:first + pattern_rows].astype(np.float64)
+            block += np.dot(chunk[:, start:end].T, chunk)  # exact sums of +-1 products
+        if not np.issubdtype(weights.dtype, np.integer):
+            block /= num_patterns
+        block[np.arange(end - start), np.arange(start, end)] = 0  # no self-connections
+        weights[start:end] = block
+    return weights
+
+
+def _hollow_rows(weights, start, num_rows):
+    """Reads a block of rows of a weights matrix as float64, their diagonal elements being zeroed"""
+
+    rows = np.array(weights[start:start + num_rows], dtype=np.float64)
+    rows[np.arange(rows.shape[0]), np.arange(start, start + rows.shape[0])] = 0
+    return rows
+
+
+def storkey_weights_out_of_core(patterns, weights, memory_budget=2 ** 28, block_size=64):
+    """Fills a (memory-mapped) weights matrix with the storkey learning rule by blocks of rows, so that the matrix
+    is never held in memory
+
+    The patterns are folded in by blocks as in storkey_weights_blocked, each block costing a single pass over the
+    rows of the matrix: a block of rows is read, receives the rank-2B update of the current patterns, gives its
+    contribution to the local fields of the next patterns and is written back.
+
+    Parameters:
+    --------------
+    patterns : array
+    -> binary patterns (-1 or 1) to which the storkey learning rule will be applied
+    weights : array
+    -> N x N floating output array, typically a np.memmap, holding the weights matrix to start from (zeros for a
+    new matrix) and updated in place
+    memory_budget : int
+    -> approximate number of bytes that the temporary blocks can use
+    block_size : int
+    -> number of patterns folded in per pass over the matrix
+
+    Output:
+    --------------
+    writes the weights matrix into weights
+
+    CU : the elements of the patterns are either -1 or 1, memory_budget > 0 and block_size > 0
+    """
+
+    num_patterns, size = patterns.shape
+    scale = 1 + 2 / size
+    block_size = min(block_size, max(num_patterns, 1))
+    rows_per_block = max(1, (memory_budget - 6 * 8 * block_size * size) // (3 * 8 * size))  # rows + 2 products
+    starts = range(0, size, rows_per_block)
+    diagonal = np.array(np.diagonal(weights), dtype=np.float64)
+    block = patterns[:block_size].astype(np.float64)
+    fields_0 = np.concatenate([np.dot(_hollow_rows(weights, start, rows_per_block), block.T)
+                               for start in starts])  # W_h.P_block^T
+    for first in range(0, num_patterns, block_size):
+        fields, coefficients, diagonal = _storkey_block(fields_0, block, diagonal)
+        left, right = (block - fields) * coefficients[:, None], block * coefficients[:, None]
+        next_block = patterns[first + block_size:first + 2 * block_size].astype(np.float64)
+        for start in starts:
+            rows = _hollow_rows(weights, start, rows_per_block)
+            end = start + rows.shape[0]
+            rows *= scale ** block.shape[0]
+            rows += np.dot(left[:, start:end].T, block)  # rank-2B update of the rows
+            rows -= np.dot(right[:, start:end].T, fields)
+            index = np.arange(end - start), np.arange(start, end)
+            rows[index] = 0
+            fields_0[start:end, :next_block.shape[0]] = np.dot(rows, next_block.T)  # fields of the next patterns
+            rows[index] = diagonal[start:end]
+            weights[start:end] = rows
+        block, fields_0 = next_block, fields_0[:, :next_block.shape[0]]
+    return weights
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
+
+
+def image_to_pattern(image, shape=(50, 50), threshold=None):
+    """Converts an image into a pattern: the image is converted to grayscale, resized, binarized and flattened
+
+    Parameters:
+    --------------
+    image : PIL.Image.Image
+    -> image to convert
+    shape : tuple of int
+    -> (height, width) of the pattern as an image
+    threshold : int or None
+    -> gray level (0 to 255) under which a pixel is in state 1, the mean gray level of the image if None
+
+    Output:
+    --------------
+    returns the pattern (1D numpy array of int8, 1 for the dark pixels and -1 for the light ones, as displayed
+    by the 'Greys' colormap)
+    """
+
+    from PIL import Image  # imported on first use only
+
+    pixels = np.asarray(image.convert("L").resize((shape[1], shape[0]), Image.BILINEAR), dtype=np.float64)
+    if threshold is None:
+        threshold = pixels.mean()
+    return np.where(pixels < threshold, 1, -1).astype(np.int8).ravel()
+
+
+def iter_image_patterns(directory, shape=(50, 50), threshold=None, cache_dir=None):
+    """Streams the images of a directory (in the order of their names) as patterns, one image at a time
+
+    The converted patterns are cached in cache_dir as .npy files named by a hash of the content of the image file,
+    the shape and the threshold, so that an image already converted (even renamed or moved) is not decoded again.
+
+    Parameters:
+    --------------
+    directory : string or Path
+    -> directory containing the images (the files with another extension are skipped)
+    shape : tuple of int
+    -> (height, width) of the patterns as images
+    threshold : int or None
+    -> gray level under which a pixel is in state 1, the mean gray level of each image if None
+    cache_dir : string, Path or None
+    -> directory of the cached patterns, "<directory>/.pattern_cache" if None
+
+    Output:
+    --------------
+    yields the path of each image and its pattern (1D numpy array of int8 of size shape[0] * shape[1])
+    """
+
+    directory = Path(directory)
+    cache_dir = directory / ".pattern_cache" if cache_dir is None else Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for path in sorted(directory.iterdir()):
+        if not path.is_file() or path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        content = path.read_bytes()
+        key = hashlib.sha256(content + repr((tuple(shape), threshold)).encode()).hexdigest()
+        cache_path = cache_dir / (key + ".npy")
+        if cache_path.is_file():
+            yield path, np.load(cache_path)
+            continue
+
+        from PIL import Image
+
+        with Image.open(io.BytesIO(content)) as image:
+            pattern = image_to_pattern(image, shape, threshold)
+        tmp_path = cache_dir / (key + ".tmp.npy")
+        np.save(tmp_path, pattern)
+        os.replace(tmp_path, cache_path)  # a cached pattern is never read half written
+        yield path, pattern
+
+
+def load_image_patterns(directory, shape=(50, 50), threshold=None, cache_dir=None):
+    """Loads the images of a directory as patterns ready to be stored in a HopfieldNetwork (see iter_image_patterns)
+
+    Output:
+    --------------
+    returns the paths of the images (list) and the patterns (2D numpy array of int8, one pattern per row)
+    """
+
+    paths, patterns = [], []
+    for path, pattern in iter_image_patterns(directory, shape, threshold, cache_dir):
+        paths.append(path)
+        patterns.append(pattern)
+    return paths, np.array(patterns, dtype=np.int8).reshape(len(patterns), shape[0] * shape[1])
@@ -0,0 +1,40 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True, language_level=3
+"""Compiled kernel of the asynchronous Hopfield dynamics (float64 weights matrix, int8 states), selected by kernels.py
+(the local fields and the synchronous update are left to the BLAS matrix-vector product of NumPy, which is faster)"""
+
+
+def async_steps(const double[:, ::1] columns, signed char[::1] state, double[::1] fields,
+                const Py_ssize_t[::1] indices):
+    """Applies the asynchronous update rule to the given neurons one after the other, in place
+
+    Parameters:
+    --------------
+    columns : array
+    -> matrix (float64, C-contiguous) whose row i is the column i of the weights matrix: the weights matrix itself
+    when it is symmetric, so that each flip reads a contiguous row
+    state : array
+    -> network state (int8), updated in place
+    fields : array
+    -> local fields W.state (float64), kept up to date in place
+    indices : array
+    -> indices (intp) of the neurons to update, in order
+
+    Output:
+    --------------
+    returns the number of flips
+    """
+
+    cdef Py_ssize_t k, i, j, flips = 0, size = state.shape[0]
+    cdef signed char new_value
+    cdef double delta
+    with nogil:
+        for k in range(indices.shape[0]):
+            i = indices[k]
+            new_value = 1 if fields[i] >= 0 else -1
+            if new_value != state[i]:
+                delta = new_value - state[i]
+                for j in range(size):
+                    fields[j] += columns[i, j] * delta
+                state[i] = new_value
+                flips += 1
+    return flips
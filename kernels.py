@@ -0,0 +1,76 @@
+import numpy as np
+
+try:  # compiled kernel, built with "python setup.py build_ext --inplace"
+    from hopfield_kernels import async_steps
+    COMPILED = True
+except ImportError:
+    COMPILED = False
+
+
+def numpy_local_fields(weights, state, fields):
+    """Computes the local fields h = W.s in place (BLAS matrix-vector product)"""
+
+    fields[:] = np.dot(weights, state)
+
+
+def numpy_sync_update(weights, state, new_state):
+    """Applies the synchronous update rule, writing the new state in place (BLAS matrix-vector product)
+
+    Output:
+    --------------
+    returns the number of neurons which have changed (0 when the state is a fixed point)
+    """
+
+    new_state[:] = np.where(np.dot(weights, state) >= 0, 1, -1)
+    return int(np.count_nonzero(new_state != state))
+
+
+def numpy_async_steps(columns, state, fields, indices):
+    """Applies the asynchronous update rule to the given neurons one after the other, in place (NumPy version of
+    hopfield_kernels.async_steps, each flip updating the local fields with one vectorized operation on the row i of
+    columns, which is the column i of the weights matrix)
+
+    Output:
+    --------------
+    returns the number of flips
+    """
+
+    flips = 0
+    for index in indices:
+        new_value = 1 if fields[index] >= 0 else -1
+        if new_value != state[index]:
+            fields += columns[index] * (new_value - state[index])
+            state[index] = new_value
+            flips += 1
+    return flips
+
+
+# the matrix-vector products are left to the BLAS: compiled loops are about twice slower
+local_fields, sync_update = numpy_local_fields, numpy_sync_update
+if not COMPILED:
+    async_steps = numpy_async_steps
+
+
+def kernel_inputs(state, weights):
+    """Converts a state and a weights matrix to the types expected by the kernels, when it is cheap to do so
+
+    Parameters:
+    --------------
+    state : array
+    -> network state
+    weights : array
+    -> weights matrix
+
+    Output:
+    --------------
+    returns a copy of the state as int8 and the weights matrix, or None if the weights matrix is not a square
+    C-contiguous float64 array matching the state (converting it would cost more than the dynamics) or if the state
+    does not fit in int8
+    """
+
+    if weights.dtype != np.float64 or not weights.flags.c_contiguous or weights.shape != (len(state), len(state)):
+        return None
+    state_int8 = state.astype(np.int8)
+    if not np.array_equal(state_int8, state):
+        return None
+    return state_int8, weights
@@ -0,0 +1,215 @@
+import numpy as np
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RecallService:
+
+    def __init__(self, network, max_batch_size=64, max_delay=0.002, max_iter=20, history=10000):
+        """Initialize a recall service grouping the probes received within a short latency window into
+        micro-batches, each micro-batch being recalled with a single matrix product per step (see recall_batch)
+
+        Parameters:
+        --------------
+        network : HopfieldNetwork
+        -> loaded network used for all the recalls (see HopfieldNetwork.load)
+        max_batch_size : int
+        -> maximum number of probes recalled together
+        max_delay : float
+        -> maximum time (in seconds) that the first probe of a micro-batch waits for other probes
+        max_iter : int
+        -> maximum number of steps of the synchronous dynamics
+        history : int
+        -> number of recent requests and batches kept for the statistics
+
+        Output:
+        --------------
+        Initialization of all the attributes with or depending on parameters (the service is run by start)
+
+        CU: max_batch_size > 0, max_delay >= 0, max_iter >= 0 and history > 0
+        """
+
+        self.network = network
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_iter = max_iter
+        self.latencies = deque(maxlen=history)  # seconds between the reception of a probe and its answer
+        self.batch_sizes = deque(maxlen=history)
+        self.num_requests = self.num_batches = 0
+        self.queue = self.task = self.server = self.executor = None
+        self.pending = set()  # futures of the requests which have not been answered yet
+
+    async def start(self):
+        """Starts the batching loop (in-process requests can then be sent with recall)"""
+
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)  # the recalls run beside the event loop
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stops the socket server (if any) and the batching loop, waits for the recall running in the worker thread
+        (if any), and fails the requests which have not been answered with a RuntimeError"""
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.executor is not None:
+            await asyncio.to_thread(self.executor.shutdown, wait=True)  # without blocking the event loop
+            self.executor = None
+        for future in self.pending:
+            if not future.done():
+                future.set_exception(RuntimeError("The recall service was stopped before answering."))
+        self.pending.clear()
+
+    async def recall(self, state):
+        """Recalls a probe, the probe being grouped with the other probes received within the latency window
+
+        Parameters:
+        --------------
+        state : array
+        -> probe (initial network state)
+
+        Output:
+        --------------
+        returns the final state, the number of iterations run and whether the dynamics converged
+
+        CU: the service is started
+        """
+
+        state = np.asarray(state)
+        if state.shape != (self.network.w.shape[0],):  # checked here, so that it cannot fail the whole batch
+            raise ValueError(f"Expected a probe of shape ({self.network.w.shape[0]},), got {state.shape}.")
+        future = asyncio.get_running_loop().create_future()
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        await self.queue.put((state, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        """Batching loop: waits for a probe, collects the next ones until the batch is full or the latency window
+        of the first probe is over, and recalls them together"""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = batch[0][2] + self.max_delay
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                probes = np.array([state for state, future, received in batch])
+                states, iterations, converged = await loop.run_in_executor(self.executor, self.network.recall_batch,
+                                                                           probes, self.max_iter)
+            except Exception as error:  # the requests of the batch fail with the error of the recall
+                for state, future, received in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            answered = time.perf_counter()
+            for i, (state, future, received) in enumerate(batch):
+                if not future.done():  # the request may have been cancelled meanwhile
+                    future.set_result((states[i], int(iterations[i]), bool(converged[i])))
+                self.latencies.append(answered - received)
+            self.batch_sizes.append(len(batch))
+            self.num_requests += len(batch)
+            self.num_batches += 1
+
+    def stats(self):
+        """Returns the statistics of the service
+
+        Output:
+        --------------
+        returns a dictionary with the numbers of requests and batches served, and the mean, median, 99th percentile
+        and maximum of the latencies (in seconds) and the mean and maximum of the batch sizes over the recent
+        requests and batches
+        """
+
+        latencies, batch_sizes = np.array(self.latencies), np.array(self.batch_sizes)
+        stats = {"num_requests": self.num_requests, "num_batches": self.num_batches}
+        if latencies.size > 0:
+            stats.update({"latency_mean": float(latencies.mean()), "latency_p50": float(np.percentile(latencies, 50)),
+                          "latency_p99": float(np.percentile(latencies, 99)), "latency_max": float(latencies.max()),
+                          "batch_size_mean": float(batch_sizes.mean()), "batch_size_max": int(batch_sizes.max())})
+        return stats
+
+    async def serve(self, host="127.0.0.1", port=0):
+        """Accepts recall requests over a local TCP socket, one JSON object per line
+
+        A request {"state": [1, -1, ...]} is answered by {"state": [...], "iterations": int, "converged": bool},
+        a request {"stats": true} by the statistics of the service, and an invalid request by {"error": message}.
+        The requests of a connection are recalled concurrently (the requests pipelined by a client being batched
+        together) and answered in order.
+
+        Parameters:
+        --------------
+        host : string
+        -> address on which the service listens (local by default)
+        port : int
+        -> port on which the service listens (chosen by the system if 0)
+
+        Output:
+        --------------
+        starts the service if needed and returns the (host, port) on which it listens
+        """
+
+        if self.task is None:
+            await self.start()
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def _handle(self, reader, writer):
+        """Reads the requests of a connection, each request being answered by its own task"""
+
+        answers = asyncio.Queue()  # tasks of the answers, in the order of the requests
+        sender = asyncio.get_running_loop().create_task(self._send(answers, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await answers.put(asyncio.ensure_future(self._answer(line)))
+        finally:
+            await answers.put(None)
+            await sender
+            writer.close()
+
+    async def _answer(self, line):
+        """Returns the answer to a request"""
+
+        try:
+            request = json.loads(line)
+            if request.get("stats"):
+                return self.stats()
+            state, iterations, converged = await self.recall(np.array(request["state"], dtype=np.int8))
+            return {"state": state.tolist(), "iterations": iterations, "converged": converged}
+        except Exception as error:
+            return {"error": f"{type(error).__name__}: {error}"}
+
+    async def _send(self, answers, writer):
+        """Writes the answers of a connection in the order of the requests, as soon as they are ready"""
+
+        while True:
+            answer = await answers.get()
+            if answer is None:
+                break
+            writer.write(json.dumps(await answer).encode() + b"\n")
+            await writer.drain()
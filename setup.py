@@ -4,3 +4,4 @@ from Cython.Build import cythonize
 
 setup(ext_modules=cythonize('update_cython.py'))
 setup(ext_modules=cythonize('dynamics_cython.py'))
+setup(ext_modules=cythonize('hopfield_kernels.pyx'))
@@ -1,10 +1,18 @@
 from classes import *
 import functions
+import experiment
+import benchmark
 import doctest
 from pathlib import Path
 import numpy as np
+import random as rd
+import os
+import shutil
+import pytest
 import update_cython
 import dynamics_cython
+import kernels
+import service
 
 
 def test_hopfield_network():
@@ -86,6 +94,35 @@ def test_storkey_weights(benchmark):
     assert weights.shape[0] == weights.shape[1]  # testing the size of the matrix
 
 
+def storkey_weights_reference(patterns):
+    """original O(N^3) per pattern storkey rule, used as a reference for the O(N^2) engines"""
+    w = np.zeros([patterns.shape[1], patterns.shape[1]])
+    for mu in range(patterns.shape[0]):
+        w_calculation_h = w.copy()
+        np.fill_diagonal(w_calculation_h, 0)
+        pattern_calculation_h = np.dot(patterns[mu].reshape(patterns.shape[1], 1), np.ones((1, patterns.shape[1])))
+        np.fill_diagonal(pattern_calculation_h, 0)
+        h = np.dot(w_calculation_h, pattern_calculation_h)
+        w += np.outer(patterns[mu], patterns[mu]) / patterns.shape[1]
+        product_1 = patterns[mu] * h
+        w -= np.add(product_1.T, product_1) / patterns.shape[1]
+    return w
+
+
+def test_storkey_engines_match_reference():
+    """testing that the incremental and blocked storkey engines match the original storkey rule"""
+    patterns = functions.generate_patterns(30, 60)
+    reference = storkey_weights_reference(patterns)
+
+    assert np.allclose(functions.storkey_weights_incremental(patterns), reference)
+    for block_size in [1, 7, 30, 64]:
+        assert np.allclose(functions.storkey_weights_blocked(patterns, block_size), reference)
+
+    # testing that learning the patterns in two steps gives the same weights
+    weights = functions.storkey_weights_blocked(patterns[:10])
+    assert np.allclose(functions.storkey_weights_blocked(patterns[10:], 4, weights), reference)
+
+
 def test_dynamics():
     """testing the function dynamics"""
     s = np.array([1, 8, 0, 9])
@@ -102,6 +139,23 @@ def test_dynamics():
     assert saver_test.data != ([], [])  # testing that the method dynamics_async saves the states in the saver
 
     
+def test_recall_batch():
+    """testing that the batched recall gives the same final states as the dynamics run probe by probe"""
+    patterns = functions.generate_patterns(5, 100)
+    network = HopfieldNetwork(patterns, "storkey")
+    probes = np.array([functions.perturb_pattern(patterns[i % 5], 30) for i in range(20)])
+
+    states, iterations, converged = network.recall_batch(probes, max_iter=20)
+
+    assert states.shape == probes.shape
+    for probe, state, num_iter, has_converged in zip(probes, states, iterations, converged):
+        saver_test = DataSaver()
+        network.dynamics(probe, saver_test, max_iter=20)
+        assert np.array_equal(saver_test.get_data()["state"][-1], state)
+        assert len(saver_test.get_data()["state"]) == num_iter + 1
+        assert has_converged == np.array_equal(saver_test.get_data()["state"][-2], state)
+
+
 def test_dynamics_async():
     """testing the function dynamics_async"""
     s = np.array([1, 8, 0, 9])
@@ -116,6 +170,25 @@ def test_dynamics_async():
     assert saver_test.data != ([], [])  # testing that the method dynamics_async saves the states in the saver
 
     
+def test_dynamics_async_fixed_point():
+    """testing that the asynchronous dynamics with cached local fields reports true fixed points"""
+    patterns = functions.generate_patterns(3, 200)
+    for rule in ["hebbian", "storkey"]:
+        network = HopfieldNetwork(patterns, rule)
+        saver_test = DataSaver()
+        converged = network.dynamics_async(functions.perturb_pattern(patterns[0], 40), saver_test, max_iter=20000,
+                                           skip=7, order="permutation")
+        final_state = saver_test.get_data()["state"][-1]
+
+        assert converged  # a full sweep without flips has been reached
+        assert np.array_equal(network.update(final_state), final_state)  # testing that it is a fixed point
+
+    saver_test = DataSaver()
+    converged = network.dynamics_async(functions.perturb_pattern(patterns[1], 40), saver_test, max_iter=5)
+    assert not converged  # 5 single-neuron steps cannot correct 40 perturbations
+    assert len(saver_test.get_data()["state"]) == 3  # initial state, state at step 0 and final state
+
+
 def test_energy(benchmark):
     """testing the function energy"""
     s = np.array([[2, 5]])
@@ -127,6 +200,52 @@ def test_energy(benchmark):
     assert np.allclose(np.array([e]), np.array([[-24.5]]))
 
 
+def test_energy_tracking():
+    """testing that the tracked energies are the same as the energies recomputed for each stored state"""
+    patterns = functions.generate_patterns(4, 80)
+    for rule in ["hebbian", "storkey"]:  # the storkey weights matrix has a non-zero diagonal
+        network = HopfieldNetwork(patterns, rule)
+        state = functions.perturb_pattern(patterns[0], 25)
+        for dynamics in [network.dynamics, network.dynamics_async]:
+            saver_test = DataSaver()
+            saver_tracked = DataSaver(track_energy=True, verify_every=1)  # every tracked energy is verified
+            rd.seed(0)
+            dynamics(state, saver_test)
+            rd.seed(0)
+            dynamics(state, saver_tracked)
+            assert np.allclose(saver_tracked.get_data()["energy"], saver_test.get_data()["energy"])
+
+    # float32 weights: the verification tolerates the rounding errors of their precision
+    patterns = functions.generate_patterns(20, 500)
+    for rule in ["hebbian", "storkey"]:
+        network = HopfieldNetwork(patterns, rule, dtype=np.float32)
+        state = functions.perturb_pattern(patterns[0], 150)
+        network.dynamics(state, DataSaver(track_energy=True, verify_every=1))
+        network.dynamics_async(state, DataSaver(track_energy=True, verify_every=1), 5000, skip=1)
+
+    # fixed connectivity: the weights matrix is not symmetric, the energy only depending on its symmetric part
+    patterns = functions.generate_patterns(4, 200)
+    for rule, dtype in [("hebbian", np.float64), ("hebbian", np.int32), ("storkey", np.float64)]:
+        network = HopfieldNetwork(patterns, rule, dtype, connectivity="fixed", degree=20, rng=np.random.default_rng(0))
+        assert (network.w != network.w.T).nnz > 0
+        state = functions.perturb_pattern(patterns[0], 60)
+        for dynamics in [network.dynamics, network.dynamics_async]:
+            saver_test = DataSaver()
+            saver_tracked = DataSaver(track_energy=True, verify_every=1)
+            rd.seed(0)
+            dynamics(state, saver_test)
+            rd.seed(0)
+            dynamics(state, saver_tracked)
+            assert np.allclose(saver_tracked.get_data()["energy"], saver_test.get_data()["energy"])
+
+    # testing that the verification detects a wrong tracked energy
+    saver_tracked = DataSaver(track_energy=True, verify_every=1)
+    saver_tracked.store_iter(state, network.w)
+    saver_tracked.energy += 1
+    with pytest.raises(RuntimeError):
+        saver_tracked.store_iter(state, network.w, tracked=True)
+
+
 def test_create_checkerboard():
     """testing the function create_checkerboard"""
     list_checkerboard = [-1, 1]
@@ -147,6 +266,7 @@ def test_pattern_match():
     assert functions.pattern_match(a, c) is None
     
        
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
 def test_save_video():
     """testing the function save_video"""
     random_patterns = functions.generate_patterns(2, 2500)
@@ -175,6 +295,68 @@ def test_arguments_class_HopfieldNetwork():
     # the storkey learning rule
     
     
+def test_add_and_remove_patterns():
+    """testing that adding or removing patterns gives the same network as rebuilding it"""
+    patterns = functions.generate_patterns(12, 40)
+
+    for rule in ["hebbian", "storkey"]:
+        network = HopfieldNetwork(patterns[:5], rule)
+        network.add_patterns(patterns[5])  # adding a single pattern
+        network.add_patterns(patterns[6:])
+        assert np.allclose(network.w, HopfieldNetwork(patterns, rule).w)
+        assert np.array_equal(network.patterns, patterns)
+
+    network = HopfieldNetwork(patterns)
+    network.remove_patterns([2, 7])
+    assert np.allclose(network.w, HopfieldNetwork(np.delete(patterns, [2, 7], axis=0)).w)
+    assert network.patterns.shape == (10, 40)
+
+    with pytest.raises(ValueError):
+        HopfieldNetwork(patterns, "storkey").remove_patterns(0)
+
+
+def test_compact_dtypes():
+    """testing that compact weights and states give the same updates and energies as the float64 ones"""
+    patterns = functions.generate_patterns(7, 100)  # odd number of patterns and even size: no field is ever 0
+    assert patterns.dtype == np.int8
+
+    network = HopfieldNetwork(patterns)
+    network_int = HopfieldNetwork(patterns, dtype=np.int32)
+    network_float32 = HopfieldNetwork(patterns, dtype=np.float32)
+    assert network_int.w.dtype == np.int32 and network_float32.w.dtype == np.float32
+    assert np.allclose(network_int.w * network_int.weight_scale, network.w)
+
+    state = functions.perturb_pattern(patterns[0], 20)
+    for compact_network in [network_int, network_float32]:
+        assert np.array_equal(compact_network.update(state), network.update(state))
+        assert compact_network.update(state).dtype == np.int8
+        assert np.allclose(DataSaver().compute_energy(state, compact_network.w, compact_network.weight_scale),
+                           DataSaver().compute_energy(state, network.w), rtol=1e-5)
+
+    # testing that the integer counts stay exact when patterns are added or removed
+    network_int.add_patterns(functions.generate_patterns(2, 100))
+    network_int.remove_patterns([0])
+    assert np.allclose(network_int.w * network_int.weight_scale, HopfieldNetwork(network_int.patterns).w)
+
+    with pytest.raises(ValueError):
+        HopfieldNetwork(patterns, "storkey", dtype=np.int32)
+
+    # narrow integer weights: the local fields (up to N.P) are accumulated without overflow
+    patterns = functions.generate_patterns(101, 2000)
+    network, network_int8 = HopfieldNetwork(patterns), HopfieldNetwork(patterns, dtype=np.int8)
+    state = functions.perturb_pattern(patterns[0], 600)
+    assert np.array_equal(network_int8.update(state), network.update(state))
+    assert np.array_equal(network_int8.recall_batch(patterns[:3])[0], network.recall_batch(patterns[:3])[0])
+    assert np.isclose(DataSaver().compute_energy(state, network_int8.w, network_int8.weight_scale),
+                      DataSaver().compute_energy(state, network.w))
+    fields = network_int8._cached_fields(state)
+    network_int8._add_column(fields, 0, -2 * state[0])
+    state[0] = -state[0]
+    assert np.array_equal(fields, network_int8.w.astype(np.int64).dot(state))
+    with pytest.raises(ValueError):  # the counts of 200 patterns do not fit in int8
+        HopfieldNetwork(functions.generate_patterns(200, 10), dtype=np.int8)
+
+
 def test_reset_method_class_DataSaver():
     """testing if the reset method of the class DataSaver resets all the arguments"""
     saver_test = DataSaver()
@@ -189,6 +371,28 @@ def test_reset_method_class_DataSaver():
     # contain any value
     
     
+def test_memmap_data_saver(tmp_path):
+    """testing that the memory-mapped saver stores the same trajectory as the in-memory one"""
+    patterns = functions.generate_patterns(3, 100)
+    network = HopfieldNetwork(patterns)
+    saver_test = DataSaver()
+    saver_memmap = MemmapDataSaver(tmp_path / "trajectory.bin", capacity=4, buffer_size=8)
+    state = functions.perturb_pattern(patterns[0], 30)
+    for saver in [saver_test, saver_memmap]:
+        rd.seed(0)
+        network.dynamics_async(state, saver, max_iter=500, skip=3)
+
+    assert len(saver_memmap) == len(saver_test.get_data()["state"])
+    assert saver_memmap.capacity > 4  # testing that the file has grown
+    for state_test, state_memmap in zip(saver_test.get_data()["state"], saver_memmap.get_data()["state"]):
+        assert np.array_equal(state_test, state_memmap)
+    assert np.allclose(np.asarray(saver_memmap.get_data()["energy"]), saver_test.get_data()["energy"])
+    assert np.array_equal(saver_memmap.get_data()["state"][-1], saver_test.get_data()["state"][-1])
+
+    saver_memmap.reset()
+    assert len(saver_memmap.get_data()["state"]) == 0
+
+
 def test_plot_energy():
     """testing if the plot of energy is done"""
     saver_test = DataSaver()
@@ -199,3 +403,492 @@ def test_plot_energy():
     saver_test.store_iter(s1, w)
     saver_test.plot_energy()  # displays a test curve to see if the plotting method works
 
+
+def test_parallel_experiment():
+    """testing that the parallel sweep is reproducible and returns the results in the format of experiment"""
+    cells = experiment.sweep_cells([10, 18])
+    results = experiment.parallel_experiment(cells, num_trials=4, seed=1, max_workers=2)
+
+    assert results == experiment.parallel_experiment(cells, num_trials=4, seed=1, max_workers=1)
+    assert [(result["network_size"], result["weight_rule"]) for result in results] == \
+           [([10], ["hebbian"]), ([10], ["storkey"]), ([18], ["hebbian"]), ([18], ["storkey"])]
+    for result, cell in zip(results, cells):
+        assert result["num_patterns"] == cell[2]
+        assert len(result["match_frac"]) == len(cell[2])
+
+
+def test_worker_blas_threads(monkeypatch):
+    """testing that the initializer of the worker processes runs their BLAS on one thread"""
+    threadpoolctl = pytest.importorskip("threadpoolctl")
+    for name in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+        monkeypatch.setenv(name, "4")  # restored after the test
+    with threadpoolctl.threadpool_limits(4):  # restored when leaving the block
+        experiment._limit_blas_threads()
+        assert all(info["num_threads"] == 1 for info in threadpoolctl.threadpool_info())
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "1"
+
+
+def test_benchmark_suite(tmp_path):
+    """testing that the benchmark suite measures the hot paths and flags regressions against a baseline"""
+    names = ["storkey_weights", "dynamics", "pattern_match"]
+    records = benchmark.run_benchmarks(names, benchmark.benchmark_configurations([10, 30]), repeat=1)
+    benchmark.save_baseline(records, tmp_path / "baseline.json")
+    baseline = benchmark.load_baseline(tmp_path / "baseline.json")
+
+    assert len(records) == 3 * 4  # two sizes and two numbers of patterns per size
+    assert all(record["error"] is None and record["time"] > 0 for record in records)
+    assert benchmark.find_regressions(records, baseline) == []
+
+    slower = [dict(record, time=10 * record["time"]) for record in records]
+    assert len(benchmark.find_regressions(slower, baseline)) == len(records)
+
+
+def test_kernels_numpy_fallback():
+    """testing that the dynamics give the same results with the kernels and with the original NumPy code"""
+    patterns = functions.generate_patterns(4, 60)
+    weights = HopfieldNetwork(patterns, "storkey").w
+    state = functions.perturb_pattern(patterns[0], 15)
+    assert kernels.kernel_inputs(state, weights) is not None
+    weights_fortran = np.asfortranarray(weights)  # same values, but the original code is used
+    assert kernels.kernel_inputs(state, weights_fortran) is None
+
+    assert np.array_equal(update_cython.update(state, weights), np.where(np.dot(weights, state) >= 0, 1, -1))
+    history = dynamics_cython.dynamics(state, weights, 20)
+    history_numpy = dynamics_cython.dynamics(state, weights_fortran, 20)
+    assert len(history) == len(history_numpy)
+    assert all(np.array_equal(a, b) for a, b in zip(history, history_numpy))
+
+    rd.seed(0)
+    history = dynamics_cython.dynamics_async(state, weights, 500, 50)
+    rd.seed(0)
+    history_numpy = dynamics_cython.dynamics_async(state, weights_fortran, 500, 50)
+    assert len(history) == len(history_numpy)
+    assert all(np.array_equal(a, b) for a, b in zip(history, history_numpy))
+
+
+@pytest.mark.skipif(not kernels.COMPILED, reason="the compiled kernels are not built")
+def test_compiled_kernels():
+    """testing that the compiled kernel and its NumPy fallback produce the same results, and that the asynchronous
+    dynamics of the network give the same states with the kernel and with the Python loop"""
+    patterns = functions.generate_patterns(5, 80)
+    weights = HopfieldNetwork(patterns, "storkey").w
+    state = functions.perturb_pattern(patterns[0], 20)
+    fields, fields_numpy = np.dot(weights, state), np.dot(weights, state)
+    indices = np.random.randint(0, 80, size=400).astype(np.intp)
+    state_numpy = state.copy()
+    flips = kernels.async_steps(weights, state, fields, indices)
+    assert flips == kernels.numpy_async_steps(weights, state_numpy, fields_numpy, indices)
+    assert np.array_equal(state, state_numpy)
+    assert np.allclose(fields, fields_numpy)
+
+    network = HopfieldNetwork(functions.generate_patterns(10, 300), "storkey")
+    probe = functions.perturb_pattern(network.patterns[0], 90)
+    for order, skip, max_iter, convergence_num_iter in [("random", 7, 3000, 100), ("random", 1, 50, 1000),
+                                                       ("permutation", 10, 5000, 100)]:
+        savers = [DataSaver(), DataSaver(track_energy=True)]  # the energy tracking runs the Python loop
+        assert network._kernel_inputs(probe, savers[0]) is not None
+        assert network._kernel_inputs(probe, savers[1]) is None
+        fixed_points = []
+        for saver in savers:
+            rd.seed(0)
+            np.random.seed(0)
+            fixed_points.append(network.dynamics_async(probe, saver, max_iter, convergence_num_iter, skip, order))
+        history, history_python = savers[0].get_data()["state"], savers[1].get_data()["state"]
+        assert fixed_points[0] == fixed_points[1] and len(history) == len(history_python)
+        assert all(np.array_equal(a, b) for a, b in zip(history, history_python))
+
+
+def test_pattern_index():
+    """testing the exact, approximate and batched look-ups of the pattern index"""
+    patterns = functions.generate_patterns(30, 64)
+    patterns[7] = patterns[3]  # duplicated pattern: the first row is returned, as with pattern_match
+    pattern_index = PatternIndex(patterns)
+    perturbed = patterns[5].copy()
+    perturbed[:3] = -perturbed[:3]
+
+    assert pattern_index.match(patterns[12]) == functions.pattern_match(patterns, patterns[12]) == 12
+    assert pattern_index.match(patterns[7]) == functions.pattern_match(patterns, patterns[7]) == 3
+    assert pattern_index.match(perturbed) is None
+    assert pattern_index.match(perturbed, max_distance=3) == 5
+    assert pattern_index.match(perturbed, max_distance=2) is None
+
+    states = np.array([patterns[12], patterns[7], perturbed])
+    assert list(pattern_index.match_batch(states)) == [12, 3, -1]
+    assert list(pattern_index.match_batch(states, max_distance=3)) == [12, 3, 5]
+
+
+def test_diluted_network():
+    """testing the diluted networks against the dense ones, and the dynamics on CSR weights"""
+    patterns = functions.generate_patterns(4, 40)
+    for rule in ["hebbian", "storkey"]:
+        dense = HopfieldNetwork(patterns, rule).w
+        full = HopfieldNetwork(patterns, rule, connectivity="fixed", degree=39).w.toarray()  # all the connections
+        assert np.allclose(full, dense - np.diag(np.diag(dense)))
+
+    patterns = functions.generate_patterns(3, 200)
+    network = HopfieldNetwork(patterns, "hebbian", connectivity="fixed", degree=30, rng=np.random.default_rng(0))
+    assert np.all(np.diff(network.w.indptr) == 30)
+    assert np.all(network.w.diagonal() == 0)
+    symmetric = HopfieldNetwork(patterns, "storkey", connectivity="random", degree=30, rng=np.random.default_rng(0))
+    assert (abs(symmetric.w - symmetric.w.T)).max() < 1e-12
+
+    state = functions.perturb_pattern(patterns[0], 20)
+    fields = network.w.toarray().dot(state)
+    assert np.all((network.update(state) == np.where(fields >= 0, 1, -1)) | np.isclose(fields, 0))
+    saver = DataSaver(track_energy=True, verify_every=1)
+    assert symmetric.dynamics_async(state, saver, max_iter=2000, order="permutation")
+    saver = DataSaver(track_energy=True, verify_every=1)
+    symmetric.dynamics(state, saver)
+    states, iterations, converged = symmetric.recall_batch(np.array([state, patterns[1]]))
+    assert np.array_equal(states[0], saver.get_data()["state"][-1])
+
+    extra = functions.generate_patterns(2, 200)
+    network.add_patterns(extra)
+    rebuilt = HopfieldNetwork(np.vstack([patterns, extra]), "hebbian", connectivity="fixed", degree=30,
+                              rng=np.random.default_rng(0))
+    assert np.allclose(network.w.toarray(), rebuilt.w.toarray())
+    network.remove_patterns([3, 4])
+    assert np.allclose(network.w.toarray(), HopfieldNetwork(patterns, "hebbian", connectivity="fixed", degree=30,
+                                                            rng=np.random.default_rng(0)).w.toarray())
+
+
+def test_low_rank_weights():
+    """testing that the factored hebbian weights behave as the dense weights matrix"""
+    patterns = functions.generate_patterns(5, 60)
+    dense = HopfieldNetwork(patterns)
+    low_rank = HopfieldNetwork(patterns, low_rank=True)
+    assert isinstance(low_rank.w, LowRankWeights)
+    state = functions.perturb_pattern(patterns[0], 15)
+
+    assert np.allclose(low_rank.w.dot(state), dense.w.dot(state))
+    assert np.allclose(low_rank.w[7], dense.w[7]) and np.allclose(low_rank.w[:, 7], dense.w[:, 7])
+    assert np.allclose(low_rank.w[np.ix_([1, 4, 4], [4, 2])], dense.w[np.ix_([1, 4, 4], [4, 2])])
+    assert np.array_equal(low_rank.update(state), dense.update(state))
+    assert np.isclose(DataSaver().compute_energy(state, low_rank.w), DataSaver().compute_energy(state, dense.w))
+
+    for network in [dense, low_rank]:
+        np.random.seed(0)
+        saver = DataSaver(track_energy=True, verify_every=1)
+        assert network.dynamics_async(state, saver, max_iter=1000, order="permutation")
+        network.recall_batch(np.array([state, patterns[1]]))
+    low_rank.add_patterns(patterns[:2])
+    dense.add_patterns(patterns[:2])
+    assert np.allclose(low_rank.w.dot(state), dense.w.dot(state))
+    low_rank.remove_patterns([0, 5])
+    dense.remove_patterns([0, 5])
+    assert np.allclose(low_rank.w.dot(state), dense.w.dot(state))
+    with pytest.raises(ValueError):
+        HopfieldNetwork(patterns, "storkey", low_rank=True)
+
+
+def test_save_and_load(tmp_path):
+    """testing that the saved networks are loaded (memory-mapped or not) with the same weights"""
+    patterns = functions.generate_patterns(4, 50)
+    state = functions.perturb_pattern(patterns[0], 10)
+    options = [{"rule": "storkey"}, {"dtype": np.int16}, {"low_rank": True}, {"connectivity": "fixed", "degree": 10}]
+    for i, kwargs in enumerate(options):
+        network = HopfieldNetwork(patterns, **kwargs)
+        network.save(tmp_path / str(i))
+        for mmap in [True, False]:
+            loaded = HopfieldNetwork.load(tmp_path / str(i), mmap=mmap)
+            assert loaded.rule == network.rule and loaded.dtype == network.dtype
+            assert loaded.weight_scale == network.weight_scale
+            assert np.array_equal(loaded.patterns, patterns)
+            assert np.allclose(loaded.w.dot(state), network.w.dot(state))
+            assert np.array_equal(loaded.update(state), network.update(state))
+    loaded = HopfieldNetwork.load(tmp_path / "0")
+    assert isinstance(loaded.w, np.memmap)
+    loaded.add_patterns(patterns[:1])  # copy-on-write: the saved weights are left unchanged
+    assert np.allclose(HopfieldNetwork.load(tmp_path / "0").w, HopfieldNetwork(patterns, "storkey").w)
+
+
+def test_save_video_writers(tmp_path, monkeypatch):
+    """testing the GIF and PNG writers of save_video, which do not need ffmpeg, and the PNG fallback without ffmpeg"""
+    from PIL import Image
+    patterns = functions.generate_patterns(2, 100)
+    saver = MemmapDataSaver(tmp_path / "trajectory.bin")
+    HopfieldNetwork(patterns).dynamics_async(functions.perturb_pattern(patterns[0], 30), saver, 500, skip=10)
+    num_states = len(saver.get_data()["state"])
+
+    frames = list(saver._frames((10, 10), stride=1, scale=3))
+    assert len(frames) == num_states and frames[0].shape == (30, 30) and frames[0].dtype == np.uint8
+    assert set(np.unique(frames[-1])) <= {0, 255}
+
+    gif_path = saver.save_video(tmp_path / "video.gif", (10, 10), stride=2)
+    assert gif_path == tmp_path / "video.gif" and gif_path.is_file()
+    with Image.open(gif_path) as image:
+        assert image.size == (40, 40)
+    with pytest.raises(ValueError):  # the extension of the path is never changed
+        saver.save_video(tmp_path / "video.mp4", (10, 10), writer="gif")
+    png_path = saver.save_video(tmp_path / "video.mp4", (10, 10), stride=num_states, writer="png")
+    assert png_path.is_file() and len(list(tmp_path.glob("video_*.png"))) == min(num_states, 2)
+
+    import matplotlib
+    monkeypatch.setitem(matplotlib.rcParams, "animation.ffmpeg_path", "missing_ffmpeg")  # ffmpeg not installed
+    auto_path = saver.save_video(tmp_path / "auto.mp4", (10, 10), stride=num_states)
+    assert auto_path == tmp_path / "auto_00000.png" and auto_path.is_file() and not (tmp_path / "auto.mp4").exists()
+    with pytest.raises(RuntimeError):
+        saver.save_video(tmp_path / "auto.mp4", (10, 10), writer="ffmpeg")
+
+
+def test_capacity_search():
+    """testing that the adaptive capacity search brackets the threshold with few networks"""
+    assert [round(bound, 3) for bound in functions.wilson_interval(9, 10)] == [0.596, 0.982]
+    results_dict = experiment.capacity_search(100, "hebbian", rng=np.random.default_rng(0))
+    assert set(experiment.experiment(10, [1], "hebbian", 2, [], [], 1, 10)) <= set(results_dict)
+    assert results_dict["num_patterns"] == sorted(results_dict["num_patterns"])
+    capacity = results_dict["capacity"][0]
+    match_fracs = dict(zip(results_dict["num_patterns"], results_dict["match_frac"]))
+    assert match_fracs[capacity] >= 0.9
+    assert any(num_pattern > capacity and match_frac < 0.9 for num_pattern, match_frac in match_fracs.items())
+    assert sum(results_dict["num_trials"]) < 10 * 50  # a fixed grid of 10 points run with 50 trials each
+    lower, upper = results_dict["confidence_interval"][0]
+    assert 0 < lower <= capacity and (upper is None or upper >= capacity)
+
+    results_dict = experiment.capacity_search(100, "hebbian", max_trials=30, rng=np.random.default_rng(0))
+    assert all(10 <= num_trials <= 30 for num_trials in results_dict["num_trials"])
+
+
+def test_sequential_experiment():
+    """testing that the sequential mode stops the trials early without changing the clear-cut decisions"""
+    successful, unsuccessful = [], []
+    results_dict = experiment.experiment(100, [2, 40], "hebbian", 20, successful, unsuccessful, num_trials=100,
+                                         rng=np.random.default_rng(0), sequential=True)
+    assert successful == [2] and unsuccessful == [40]
+    assert results_dict["num_trials"][0] < 100 and results_dict["num_trials"][1] < 100
+    assert results_dict["match_frac"][0] >= 0.9 > results_dict["match_frac"][1]
+
+    results_dict = experiment.experiment(100, [40], "hebbian", 20, [], [], num_trials=10, rng=np.random.default_rng(0))
+    assert results_dict["num_trials"] == [10]
+    assert experiment._decided(0, 2, 10, 0.9, 1.96)  # 2 failures out of 10 trials: the fraction is below 0.9
+    assert not experiment._decided(8, 8, 10, 0.9, 1.96)
+    assert not experiment._decided(10, 20, 100, 0.9, 1.96, min_trials=21) and experiment._decided(10, 20, 100, 0.9, 1.96)
+
+    # misclassification rate of the sequential decision, for a true match fraction of 0.95 and a cap of 100 trials
+    # (about 1.1% when the 100 trials are run, and 7% when the Wilson interval is looked at from the first trial)
+    draws = np.random.default_rng(0).random((1000, 100)) < 0.95
+    wrong = {1: 0, 20: 0}
+    for min_trials in wrong:
+        for outcomes in draws:
+            successes = np.cumsum(outcomes)
+            trials = next(t for t in range(1, 101)
+                          if experiment._decided(successes[t - 1], t, 100, 0.9, 1.96, min_trials))
+            wrong[min_trials] += successes[trials - 1] / trials < 0.9
+    assert wrong[20] / 1000 < 0.025 < wrong[1] / 1000
+
+    results = experiment.parallel_experiment([(50, "hebbian", [1, 20], 10)], num_trials=30, seed=0, max_workers=1,
+                                             sequential=True)
+    assert len(results[0]["num_trials"]) == 2 and max(results[0]["num_trials"]) < 30
+
+
+def test_limit_cycles():
+    """testing that the synchronous dynamics stop as soon as they enter a fixed point or a limit cycle"""
+    network = HopfieldNetwork(functions.generate_patterns(2, 4))
+    network.w = -np.ones((4, 4)) + np.eye(4)  # oscillating network: all the neurons flip at each step
+    state = np.array([1, 1, 1, -1])
+    saver = DataSaver()
+    assert network.dynamics(state, saver, max_iter=100) == (2, 1)  # [1, 1, 1, -1] -> [-1, -1, -1, -1] -> [1, 1, 1, 1]
+    assert len(saver.get_data()["state"]) == 4
+
+    patterns = functions.generate_patterns(3, 50)
+    saver = DataSaver()
+    cycle_length, entry_step = HopfieldNetwork(patterns).dynamics(patterns[0], saver)
+    assert (cycle_length, entry_step) == (1, 0) and len(saver.get_data()["state"]) == 2
+
+    for weights in [network.w, np.asfortranarray(network.w)]:  # kernels, or the original code
+        history, cycle_length, entry_step = dynamics_cython.dynamics(state, weights, 100, return_cycle=True)
+        assert (cycle_length, entry_step) == (2, 1) and len(history) == 4
+    assert len(dynamics_cython.dynamics(state, network.w, 100)) == 4
+
+    # the batched recall stops the probes in their 2-cycle too
+    states, iterations, converged = network.recall_batch(np.array([[1, 1, 1, -1], [1, 1, 1, 1]]), max_iter=100)
+    assert list(iterations) == [3, 2] and not converged.any()
+
+
+def test_results_store(tmp_path):
+    """testing that the results store keeps the finished cells and that an interrupted sweep is resumed"""
+    cells = [(20, "hebbian", [1, 3], 4), (20, "storkey", [2], 4)]
+    store = ResultsStore(tmp_path / "store")
+    store.append(20, "hebbian", 1, 4, 0.5, 3)  # cell finished before an interruption
+    with open(tmp_path / "store" / "match_frac.bin", "ab") as file:
+        file.write(b"\0" * 3)  # row left incomplete by a crash
+    store = ResultsStore(tmp_path / "store")
+    assert len(store) == 1
+
+    results = experiment.parallel_experiment(cells, num_trials=3, seed=0, max_workers=1, store=store)
+    assert len(store) == 3 and results[0]["match_frac"][0] == 0.5  # the stored cell is not run again
+    assert results == experiment.parallel_experiment(cells, num_trials=3, seed=0, max_workers=1,
+                                                     store=ResultsStore(tmp_path / "store"))
+    assert len(ResultsStore(tmp_path / "store")) == 3
+    assert store.results() == results
+    assert store.results("storkey") == results[1:]
+    assert isinstance(store.column("match_frac"), np.memmap)
+
+    for settings in [{"num_trials": 5}, {"seed": 1}, {"sequential": True}, {"max_iter": 10}]:
+        with pytest.raises(ValueError):  # the stored results cannot be reused with other settings
+            experiment.parallel_experiment(cells, **dict({"num_trials": 3, "seed": 0, "max_workers": 1}, **settings),
+                                           store=store)
+    results = experiment.parallel_experiment([(20, "hebbian", [1], 8)], num_trials=3, seed=0, max_workers=1,
+                                             store=store)
+    assert len(store) == 4 and results[0]["num_perturb"] == [8]  # another number of perturbations is another cell
+    hebbian_results = store.results("hebbian")
+    assert [results_dict["num_perturb"] for results_dict in hebbian_results] == [[4], [8]]
+    assert hebbian_results[0]["num_patterns"] == [1, 3] and hebbian_results[1] == results[0]
+
+
+def test_tracer(tmp_path):
+    """testing the records of the tracer and their aggregation per sweep cell"""
+    tracer = Tracer()
+    patterns = functions.generate_patterns(3, 50)
+    network = HopfieldNetwork(patterns, "storkey", tracer=tracer)
+    state = functions.perturb_pattern(patterns[0], 10)
+    saver = DataSaver()
+    network.dynamics(state, saver)
+    network.dynamics_async(state, DataSaver(), max_iter=200, skip=20)
+    assert [record["call"] for record in tracer.records] == ["build_weights", "dynamics", "dynamics_async"]
+    build, dynamics, dynamics_async = tracer.records
+    assert build["rule"] == "storkey" and build["num_patterns"] == 3 and build["time"] > 0
+    assert dynamics["iterations"] == len(saver.get_data()["state"]) - 1
+    assert dynamics["flips"] >= np.count_nonzero(saver.get_data()["state"][-1] != state)
+    assert 0 < dynamics["energy_time"] + dynamics["check_time"] < dynamics["time"]
+    assert dynamics_async["iterations"] <= 200 and dynamics_async["energy_time"] > 0
+
+    tracer.to_json(tmp_path / "trace.json")
+    tracer.to_csv(tmp_path / "trace.csv")
+    assert len((tmp_path / "trace.csv").read_text().splitlines()) == 4
+    assert tracer.summary()["dynamics"]["calls"] == 1
+
+    results_dict = experiment.experiment(50, [2, 5], "hebbian", 10, [], [], num_trials=3, tracer=Tracer())
+    assert [trace["dynamics"]["calls"] for trace in results_dict["trace"]] == [3, 3]
+    assert all(trace["build_weights"]["calls"] == 1 for trace in results_dict["trace"])
+    assert "trace" not in experiment.experiment(50, [2], "hebbian", 10, [], [], num_trials=1)
+
+
+def test_headless_imports():
+    """testing that the core modules are imported without the plotting, video and optional dependencies"""
+    for module in benchmark.IMPORT_MODULES:
+        record = benchmark.run_import_benchmark(module, repeat=1)
+        assert record["error"] is None and record["time"] > 0 and record["peak_memory"] > 0
+        assert record["heavy_modules"] == []  # matplotlib, scipy, pandas and PIL are loaded on first use only
+    assert "error" in benchmark.format_record(benchmark.run_import_benchmark("missing_module", repeat=1))
+
+
+def test_robustness_experiment():
+    """testing the batched robustness curve against the probes recalled one by one"""
+    results_dict = experiment.robustness_experiment(100, 4, "hebbian", num_trials=5, rng=np.random.default_rng(0))
+    assert results_dict["num_perturb"] == list((np.linspace(0, 1, 20) * 100).astype(int))
+    assert len(results_dict["match_frac"]) == 20 and results_dict["num_trials"] == [5] * 20
+    assert results_dict["match_frac"][0] == 1.0 and results_dict["match_frac"][-1] == 0.0  # unperturbed / inverted
+
+    # same draws as robustness_experiment, the probes being recalled one by one with dynamics
+    rng = np.random.default_rng(0)
+    patterns = functions.generate_patterns(4, 100, rng=rng)
+    network = HopfieldNetwork(patterns)
+    levels = np.repeat(results_dict["num_perturb"], 5)
+    indices_perturbed = rng.integers(0, 4, size=levels.size)
+    positions = rng.integers(0, 100, size=(levels.size, levels.max()))
+    retrieved = []
+    for level, index, draws in zip(levels, indices_perturbed, positions):
+        probe = patterns[index].copy()
+        probe[draws[:level]] = -probe[draws[:level]]
+        saver = DataSaver()
+        network.dynamics(probe, saver, 100)
+        retrieved.append(functions.pattern_match(patterns, saver.get_data()["state"][-1]) == index)
+    assert np.allclose(np.reshape(retrieved, (20, 5)).mean(axis=1), results_dict["match_frac"])
+
+
+def test_build_out_of_core(tmp_path):
+    """testing that the weights built by blocks of rows into memory-mapped files match the in-memory ones"""
+    import tracemalloc
+    patterns = functions.generate_patterns(12, 300)
+    for rule, dtype in [("hebbian", np.float64), ("hebbian", np.int16), ("storkey", np.float64)]:
+        tracemalloc.start()
+        network = HopfieldNetwork.build_out_of_core(patterns, tmp_path / f"{rule}_{np.dtype(dtype).name}", rule,
+                                                    dtype, memory_budget=2 ** 18, block_size=5)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert isinstance(network.w, np.memmap)
+        assert peak < 300 * 300 * 8  # the 720 kB weights matrix is never held in memory
+        reference = HopfieldNetwork(patterns, rule, dtype)
+        assert np.allclose(network.w, reference.w) and network.weight_scale == reference.weight_scale
+        state = functions.perturb_pattern(patterns[0], 30)
+        assert np.array_equal(network.update(state), reference.update(state))
+    with pytest.raises(ValueError):
+        HopfieldNetwork.build_out_of_core(patterns, tmp_path / "integer_storkey", "storkey", np.int16)
+    with pytest.raises(ValueError):  # the counts of 200 patterns do not fit in int8
+        HopfieldNetwork.build_out_of_core(functions.generate_patterns(200, 10), tmp_path / "int8", "hebbian", np.int8)
+    assert not (tmp_path / "int8").exists()
+
+
+def test_recall_service():
+    """testing that the recall service groups concurrent probes into micro-batches, in process and over a socket"""
+    import asyncio
+    import json
+    patterns = functions.generate_patterns(5, 100)
+    network = HopfieldNetwork(patterns)
+    probes = [functions.perturb_pattern(patterns[i % 5], 15) for i in range(20)]
+    expected_states, expected_iterations, expected_converged = network.recall_batch(np.array(probes))
+
+    async def scenario():
+        recall_service = service.RecallService(network, max_batch_size=8, max_delay=0.05)
+        await recall_service.start()
+        answers = await asyncio.gather(*[recall_service.recall(probe) for probe in probes])
+        for i, (state, iterations, converged) in enumerate(answers):
+            assert np.array_equal(state, expected_states[i]) and iterations == expected_iterations[i]
+            assert converged == expected_converged[i]
+        stats = recall_service.stats()
+        assert stats["num_requests"] == 20 and stats["num_batches"] < 20 and stats["batch_size_max"] <= 8
+        assert 0 <= stats["latency_p50"] <= stats["latency_max"]
+        with pytest.raises(ValueError):
+            await recall_service.recall(np.ones(7))  # wrong size: only this request fails
+
+        host, port = await recall_service.serve()
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(b"".join(json.dumps({"state": probe.tolist()}).encode() + b"\n" for probe in probes[:8]))
+        writer.write(b"not json\n")  # requests pipelined on one connection
+        await writer.drain()
+        answers = [json.loads(await reader.readline()) for _ in range(9)]
+        assert [answer["state"] for answer in answers[:8]] == expected_states[:8].tolist() and "error" in answers[8]
+        assert recall_service.stats()["num_batches"] < stats["num_batches"] + 8  # batched together
+        writer.write(b'{"stats": true}\n')
+        await writer.drain()
+        assert json.loads(await reader.readline())["num_requests"] == 28
+        writer.close()
+        await recall_service.stop()
+
+        # stopping the service fails the requests which have not been answered instead of leaving them pending
+        recall_service = service.RecallService(network, max_delay=10)  # the batch waits for more probes
+        await recall_service.start()
+        request = asyncio.ensure_future(recall_service.recall(probes[0]))
+        await asyncio.sleep(0.01)
+        await recall_service.stop()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(request, 1)
+        assert recall_service.executor is None and not recall_service.pending
+
+    asyncio.run(scenario())
+
+
+def test_load_image_patterns(tmp_path, monkeypatch):
+    """testing the conversion of a directory of images into patterns and the cache of the converted patterns"""
+    from PIL import Image
+    checkerboard = functions.create_checkerboard()
+    Image.fromarray(np.where(checkerboard > 0, 0, 255).astype(np.uint8)).resize((100, 100)).save(tmp_path / "a.png")
+    Image.fromarray(np.full((20, 30), 255, dtype=np.uint8)).save(tmp_path / "b.bmp")
+    (tmp_path / "notes.txt").write_text("not an image")
+
+    paths, patterns = functions.load_image_patterns(tmp_path, shape=(50, 50), threshold=128)
+    assert [path.name for path in paths] == ["a.png", "b.bmp"]
+    assert patterns.shape == (2, 2500) and patterns.dtype == np.int8
+    assert np.array_equal(patterns[0], checkerboard.flatten())  # round trip with the frames of the videos
+    assert np.all(patterns[1] == -1)
+    HopfieldNetwork(patterns)
+
+    def fail(*args):
+        raise AssertionError("the cached patterns should not be decoded again")
+    monkeypatch.setattr(functions, "image_to_pattern", fail)
+    (tmp_path / "c.png").write_bytes((tmp_path / "a.png").read_bytes())  # same content under another name
+    paths, cached = functions.load_image_patterns(tmp_path, shape=(50, 50), threshold=128)
+    assert len(paths) == 3 and np.array_equal(cached[:2], patterns) and np.array_equal(cached[2], patterns[0])
+    with pytest.raises(AssertionError):  # a new shape is a new cache key
+        functions.load_image_patterns(tmp_path, shape=(10, 10), threshold=128)
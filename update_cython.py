@@ -1,5 +1,6 @@
 import numpy as np
 import random as rd
+from kernels import kernel_inputs, sync_update
 
 
 def update(state, weights):
@@ -22,7 +23,13 @@ def update(state, weights):
     [array([1, 1])]
     """
     
-    return np.where(np.dot(weights, state) >= 0, 1, -1)
+    inputs = kernel_inputs(state, weights)
+    if inputs is None:
+        return np.where(np.dot(weights, state) >= 0, 1, -1)
+    state_int8, weights = inputs
+    new_state = np.empty_like(state_int8)
+    sync_update(weights, state_int8, new_state)  # compiled kernel when built, vectorized NumPy otherwise
+    return new_state.astype(state.dtype, copy=False)
 
 
 def update_async(state, weights):
@@ -45,8 +52,8 @@ def update_async(state, weights):
      array([-1, -1, -1,  1])
     """
     
-    index = rd.choices(np.linspace(0, weights.shape[0] - 1, weights.shape[0], dtype=int))  # chooses randomly an index
+    index = rd.randrange(weights.shape[0])  # chooses randomly an index
     pattern = state.copy()
-    pattern[index] = np.where(np.dot(weights[index], state) >= 0, 1, -1) # applying the asynchronous update rule
+    pattern[index] = 1 if np.dot(weights[index], state) >= 0 else -1  # applying the asynchronous update rule
     # (updates the i-th component of the state pattern)
     return pattern